@@ -1,22 +1,77 @@
-from flask import Flask, render_template, request, send_file, jsonify, session, redirect, url_for
+from flask import Flask, Response, render_template, request, send_file, jsonify, session, redirect, url_for
 import os
 import yaml
 import zipfile
 import io
+import csv
 import tempfile
+import shutil
 import sys
 import uuid
+import unicodedata
+import hashlib
 from datetime import datetime
 import json
 import re
-from functools import wraps
+from functools import wraps, partial
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+import threading
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
 import requests
-from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlencode, quote, unquote
+from werkzeug.exceptions import RequestEntityTooLarge
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    from flask_session import Session
+except ImportError:
+    Session = None
+
+try:
+    from celery import Celery
+except ImportError:
+    Celery = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
 
 # Import your migration functions
-from hex_migrate_redshift_to_databricks import transform_hex_yaml, load_yaml
+import hex_migrate_redshift_to_databricks
+from hex_migrate_redshift_to_databricks import transform_hex_yaml, needs_transform, SCHEMA_MAP, FUNCTION_MAPPINGS
+# libyaml-backed loader/dumper (or the pure-Python fallback), chosen once by the converter module
+from hex_migrate_redshift_to_databricks import CSafeLoader, CSafeDumper
+
+# Configure the output dumper once instead of passing the same options at every call site
+dump_yaml = partial(yaml.dump, Dumper=CSafeDumper, default_flow_style=False, sort_keys=False)
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Serve jsonify responses with orjson, which is several times faster than the json module"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+if orjson:
+    app.json = ORJSONProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'hex-migration-secret-key-2025')
 
 # Session Configuration
@@ -25,13 +80,247 @@ app.config['SESSION_COOKIE_SECURE'] = True        # HTTPS only
 app.config['SESSION_COOKIE_HTTPONLY'] = True      # No JavaScript access
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'     # CSRF protection
 
+# Compress JSON/CSV responses (disable with COMPRESS_RESPONSES=false behind a CDN that already compresses).
+# Downloads are left alone: Flask-Compress buffers the whole body, which breaks streaming,
+# Range responses and X-Sendfile
+if Compress and os.environ.get('COMPRESS_RESPONSES', 'true').lower() == 'true':
+    app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/csv']
+    app.config['COMPRESS_LEVEL'] = 5
+    Compress(app)
+
+# Reject oversized uploads before the request body is read
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 200))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+
+# Let a fronting proxy (nginx, Apache) send downloads via X-Sendfile when configured
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
+
+# Connection used when the upload doesn't specify one
+DEFAULT_DATABRICKS_CONN_ID = '0196d84e-3399-7000-ba4e-6c93736d59a8'
+
 # Google OAuth Configuration
 GOOGLE_CLIENT_ID = "671692633628-6sojfoe3q6o7jkfjpl156o2ffod8qmll.apps.googleusercontent.com"
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')  # You'll need to set this
 REDIRECT_URI = os.environ.get('REDIRECT_URI', 'https://hex-migration-tool-theta.vercel.app/auth/callback')
+GOOGLE_TIMEOUT = 5  # seconds
+
+# Google OAuth URL (constant, so built once)
+GOOGLE_AUTH_URL = "https://accounts.google.com/o/oauth2/auth?" + urlencode({
+    'client_id': GOOGLE_CLIENT_ID,
+    'redirect_uri': REDIRECT_URI,
+    'scope': 'openid email profile',
+    'response_type': 'code',
+    'hd': 'algolia.com'  # Restrict to algolia.com domain
+})
+
+LOGIN_ERROR_MESSAGES = {
+    'domain': "Access restricted to @algolia.com email addresses only."
+}
+
+# Reuse pooled connections to Google across logins instead of a new TLS handshake per call
+GOOGLE_SESSION = requests.Session()
+GOOGLE_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+class ExpiringLRUDict:
+    """Thread-safe mapping that keeps at most maxsize entries, each for at most ttl seconds"""
+    
+    def __init__(self, maxsize, ttl, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _evict(self, key):
+        _, value = self._data.pop(key)
+        if self.on_evict:
+            self.on_evict(value)
+    
+    def _expire(self, now):
+        while self._data:
+            key, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            self._evict(key)
+    
+    def __setitem__(self, key, value):
+        with self._lock:
+            now = time.monotonic()
+            self._data[key] = (now + self.ttl, value)
+            self._data.move_to_end(key)
+            self._expire(now)
+            while len(self._data) > self.maxsize:
+                self._evict(next(iter(self._data)))
+    
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                self._evict(key)
+                return default
+            self._data.move_to_end(key)
+            return entry[1]
+    
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+    
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+# Per-upload state kept in processing_results (slotted to keep large ZIP results compact)
+@dataclass(slots=True)
+class FileDetail:
+    filename: str
+    type: str
+    cells_rewritten: int
+    size_mb: float
+
+@dataclass(slots=True)
+class ProcessedFile:
+    path: str
+    filename: str
+    mimetype: str
+
+@dataclass(slots=True)
+class ProcessingResult:
+    timestamp: str
+    original_filename: str
+    databricks_conn_id: str
+    files_processed: int = 0
+    total_cells_rewritten: int = 0
+    warnings: list = field(default_factory=list)
+    errors: list = field(default_factory=list)
+    file_details: list = field(default_factory=list)
+    conversion_summary: dict = field(default_factory=dict)
+    processed_file_data: ProcessedFile | None = None
+
+# Files are moved in and out of Redis strings this many bytes at a time
+REDIS_CHUNK_SIZE = 1024 * 1024
+
+def _redis_write_file(client, key, f, ttl):
+    """Copy file f into the Redis string at key in chunks, so it is never held in memory whole.
+    
+    SET creates the key with its expiry and each chunk is APPENDed (which keeps the TTL);
+    the pipeline is flushed after every chunk so only one chunk is buffered at a time.
+    """
+    pipe = client.pipeline(transaction=False)
+    pipe.set(key, b'', ex=ttl)
+    for chunk in iter(partial(f.read, REDIS_CHUNK_SIZE), b''):
+        pipe.append(key, chunk)
+        pipe.execute()
+    pipe.execute()
 
-# Store processing results in memory (in production, use Redis or database)
-processing_results = {}
+def _redis_iter_string(client, key):
+    """Yield the Redis string at key in chunks using GETRANGE"""
+    start = 0
+    while True:
+        chunk = client.getrange(key, start, start + REDIS_CHUNK_SIZE - 1)
+        if not chunk:
+            return
+        yield chunk
+        start += len(chunk)
+
+class RedisResultStore:
+    """Processing results shared across instances through Redis, expiring after ttl seconds.
+    
+    Result metadata lives under job:<id> and the processed file under job:<id>:blob,
+    so /results and /export never pull the file bytes.
+    """
+    
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+    
+    def __setitem__(self, key, value):
+        pipe = self.client.pipeline()
+        file_data = value.processed_file_data
+        if file_data and file_data.path:
+            # Move the processed file from local disk into Redis; the metadata is written
+            # afterwards, so readers never see a result whose blob is still being copied
+            with open(file_data.path, 'rb') as f:
+                _redis_write_file(self.client, f'job:{key}:blob', f, self.ttl)
+            _remove_processed_file(value)
+            file_data.path = ''
+            # Restart the blob's TTL alongside the metadata so both keys expire together
+            pipe.expire(f'job:{key}:blob', self.ttl)
+        pipe.set(f'job:{key}', json.dumps(asdict(value)), ex=self.ttl)
+        pipe.execute()
+    
+    def get(self, key, default=None):
+        raw = self.client.get(f'job:{key}')
+        if raw is None:
+            return default
+        data = json.loads(raw)
+        data['file_details'] = [FileDetail(**detail) for detail in data['file_details']]
+        if data['processed_file_data']:
+            data['processed_file_data'] = ProcessedFile(**data['processed_file_data'])
+        return ProcessingResult(**data)
+    
+    def blob_size(self, key):
+        return self.client.strlen(f'job:{key}:blob')
+    
+    def iter_blob(self, key):
+        """Yield the stored processed file in chunks so it is never held in memory whole"""
+        return _redis_iter_string(self.client, f'job:{key}:blob')
+    
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+    
+    def __contains__(self, key):
+        return self.client.exists(f'job:{key}') > 0
+
+# Store processing results in Redis when REDIS_URL is configured so every instance
+# sees them; otherwise keep them in memory, bounded so processed files can't pile up forever
+REDIS_URL = os.environ.get('REDIS_URL')
+RESULTS_MAX_ENTRIES = int(os.environ.get('RESULTS_MAX_ENTRIES', 64))
+RESULTS_TTL = int(os.environ.get('RESULTS_TTL', 3600))  # 1 hour (in seconds)
+redis_client = redis.Redis.from_url(REDIS_URL) if redis and REDIS_URL else None
+if redis_client:
+    processing_results = RedisResultStore(redis_client, RESULTS_TTL)
+else:
+    if REDIS_URL:
+        print("⚠️  REDIS_URL is set but the redis package is not installed - keeping results in memory")
+    processing_results = ExpiringLRUDict(RESULTS_MAX_ENTRIES, RESULTS_TTL, on_evict=lambda result: _remove_processed_file(result))
+
+# Cache converted ZIP entries by content hash so re-uploaded files skip the transform
+TRANSFORM_CACHE_ENTRIES = int(os.environ.get('TRANSFORM_CACHE_ENTRIES', 256))
+TRANSFORM_CACHE_TTL = int(os.environ.get('TRANSFORM_CACHE_TTL', 7 * 86400))  # 7 days (in seconds)
+transform_cache = None if redis_client else ExpiringLRUDict(TRANSFORM_CACHE_ENTRIES, TRANSFORM_CACHE_TTL)
+
+def _transform_fingerprint():
+    """Identify the converter code and mappings so cached conversions go stale when either changes"""
+    digest = hashlib.blake2b(digest_size=8)
+    with open(hex_migrate_redshift_to_databricks.__file__, 'rb') as f:
+        digest.update(f.read())
+    digest.update(repr(SCHEMA_MAP).encode('utf-8'))
+    digest.update(repr(FUNCTION_MAPPINGS).encode('utf-8'))
+    return digest.hexdigest()
+
+TRANSFORM_FINGERPRINT = _transform_fingerprint()
+
+# Keep sessions server-side in Redis when available so only a signed session id rides in the cookie
+if redis_client and Session:
+    app.config.update(
+        SESSION_TYPE='redis',
+        SESSION_REDIS=redis_client,
+        SESSION_PERMANENT=True,
+        SESSION_USE_SIGNER=True
+    )
+    Session(app)
+
+# Run uploads on Celery workers when enabled; results are shared through the Redis store
+CELERY_ENABLED = os.environ.get('CELERY_ENABLED', 'false').lower() == 'true'
+celery = Celery('hex', broker=REDIS_URL, backend=REDIS_URL) if CELERY_ENABLED and Celery and redis_client else None
+if CELERY_ENABLED and not celery:
+    print("⚠️  CELERY_ENABLED is set but Celery or Redis is unavailable - processing uploads in the request")
 
 # For Vercel compatibility
 application = app
@@ -58,22 +347,8 @@ def index():
 
 @app.route('/login')
 def login():
-    error = request.args.get('error')
-    if error == 'domain':
-        error_msg = "Access restricted to @algolia.com email addresses only."
-    else:
-        error_msg = None
-    
-    # Google OAuth URL
-    google_auth_url = "https://accounts.google.com/o/oauth2/auth?" + urlencode({
-        'client_id': GOOGLE_CLIENT_ID,
-        'redirect_uri': REDIRECT_URI,
-        'scope': 'openid email profile',
-        'response_type': 'code',
-        'hd': 'algolia.com'  # Restrict to algolia.com domain
-    })
-    
-    return render_template('login.html', google_auth_url=google_auth_url, error=error_msg)
+    return render_template('login.html', google_auth_url=GOOGLE_AUTH_URL,
+                           error=LOGIN_ERROR_MESSAGES.get(request.args.get('error')))
 
 @app.route('/auth/callback')
 def auth_callback():
@@ -92,16 +367,16 @@ def auth_callback():
     }
     
     try:
-        import requests
-        token_response = requests.post(token_url, data=token_data)
+        token_response = GOOGLE_SESSION.post(token_url, data=token_data, timeout=GOOGLE_TIMEOUT)
         token_response.raise_for_status()
         token_json = token_response.json()
         
         # Get user info
         access_token = token_json['access_token']
-        user_info_response = requests.get(
+        user_info_response = GOOGLE_SESSION.get(
             'https://www.googleapis.com/oauth2/v2/userinfo',
-            headers={'Authorization': f'Bearer {access_token}'}
+            headers={'Authorization': f'Bearer {access_token}'},
+            timeout=GOOGLE_TIMEOUT
         )
         user_info_response.raise_for_status()
         user_info = user_info_response.json()
@@ -140,294 +415,421 @@ def main():
 @require_auth
 def upload_file():
     try:
-        if 'file' not in request.files:
+        # Check the declared size before touching request.files, which would read the whole body
+        if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+            return _upload_too_large()
+        
+        files = request.files
+        if 'file' not in files:
             return jsonify({'error': 'No file uploaded'}), 400
         
-        file = request.files['file']
-        if file.filename == '':
+        file = files['file']
+        filename = file.filename or ''
+        if filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
+        if not filename.endswith(('.yaml', '.yml', '.zip')):
+            return jsonify({'error': 'Unsupported file type. Please upload .yaml, .yml, or .zip files'}), 400
+        
         # Get databricks connection ID from form
-        databricks_conn_id = request.form.get('databricks_conn_id', '0196d84e-3399-7000-ba4e-6c93736d59a8')
+        databricks_conn_id = request.form.get('databricks_conn_id', DEFAULT_DATABRICKS_CONN_ID)
         
-        # Generate unique session ID for this processing
-        session_id = str(uuid.uuid4())
-        session['current_session'] = session_id
+        return _start_processing(file.stream, filename, databricks_conn_id)
+    
+    except RequestEntityTooLarge:
+        return _upload_too_large()
+    except Exception as e:
+        return jsonify({'error': f'Processing error: {str(e)}'}), 500
+
+@app.route('/upload/raw', methods=['POST'])
+@require_auth
+def upload_raw():
+    """Accept the file as the raw request body, skipping the multipart parser.
+    
+    The (URL-encoded) filename comes from the X-Filename header and the connection ID
+    from X-Databricks-Conn-Id.
+    """
+    try:
+        if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+            return _upload_too_large()
         
-        # Initialize processing results
-        processing_results[session_id] = {
-            'timestamp': datetime.now().isoformat(),
-            'original_filename': file.filename,
-            'databricks_conn_id': databricks_conn_id,
-            'files_processed': 0,
-            'total_cells_rewritten': 0,
-            'functions_converted': 0,
-            'tables_remapped': 0,
-            'warnings': [],
-            'errors': [],
-            'file_details': [],
-            'conversion_summary': {},
-            'processed_file_data': None
-        }
+        filename = unquote(request.headers.get('X-Filename', ''))
+        if filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        if not filename.endswith(('.yaml', '.yml', '.zip')):
+            return jsonify({'error': 'Unsupported file type. Please upload .yaml, .yml, or .zip files'}), 400
         
-        result = processing_results[session_id]
+        databricks_conn_id = request.headers.get('X-Databricks-Conn-Id') or DEFAULT_DATABRICKS_CONN_ID
         
+        # Copy the body to disk in chunks so memory stays bounded regardless of upload size
+        with tempfile.TemporaryFile() as upload:
+            shutil.copyfileobj(request.stream, upload, 1024 * 1024)
+            upload.seek(0)
+            return _start_processing(upload, filename, databricks_conn_id)
+    
+    except RequestEntityTooLarge:
+        return _upload_too_large()
+    except Exception as e:
+        return jsonify({'error': f'Processing error: {str(e)}'}), 500
+
+def _start_processing(stream, filename, databricks_conn_id):
+    """Process an upload (or queue it on a Celery worker) and build the /upload response"""
+    # Generate unique session ID for this processing
+    session_id = str(uuid.uuid4())
+    session['current_session'] = session_id
+    
+    # Hand the upload to a Celery worker when one is configured; the client polls /results
+    if celery:
+        # Copied in chunks so the web process never holds the whole upload
+        _redis_write_file(redis_client, f'job:{session_id}:upload', stream, RESULTS_TTL)
+        process_upload_task.apply_async((session_id, filename, databricks_conn_id), task_id=session_id)
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'status': 'PENDING'
+        }), 202
+    
+    return jsonify({
+        'success': True,
+        'session_id': session_id,
+        'summary': process_upload(session_id, stream, filename, databricks_conn_id)
+    })
+
+@app.errorhandler(RequestEntityTooLarge)
+def _upload_too_large(e=None):
+    return jsonify({'error': f'File too large. Maximum upload size is {MAX_UPLOAD_MB} MB'}), 413
+
+def process_upload(session_id, stream, filename, databricks_conn_id):
+    """Convert an uploaded YAML or ZIP file, store its result and return the summary"""
+    # Initialize processing results (stored once processing has finished)
+    result = ProcessingResult(
+        timestamp=datetime.now().isoformat(),
+        original_filename=filename,
+        databricks_conn_id=databricks_conn_id
+    )
+    
+    try:
         # Process single YAML file
-        if file.filename.endswith('.yaml') or file.filename.endswith('.yml'):
-            content = file.read().decode('utf-8')
-            doc = yaml.safe_load(content)
+        if filename.endswith('.yaml') or filename.endswith('.yml'):
+            # Parse straight from the upload stream; libyaml decodes the bytes itself
+            doc = yaml.load(stream, Loader=CSafeLoader)
+            upload_size = stream.tell()
             
             # Transform the document
-            new_doc, cells_rewritten = transform_hex_yaml(doc, databricks_conn_id)
+            new_doc, cells_rewritten, conversion_summary = transform_hex_yaml(doc, databricks_conn_id, in_place=True)
             
             # Update results
-            result['files_processed'] = 1
-            result['total_cells_rewritten'] = cells_rewritten
-            result['file_details'].append({
-                'filename': file.filename,
-                'type': 'YAML',
-                'cells_rewritten': cells_rewritten,
-                'size_mb': round(len(content) / 1024 / 1024, 2)
-            })
-            
-            # Convert back to YAML and store
-            output_yaml = yaml.dump(new_doc, default_flow_style=False, sort_keys=False)
-            filename = file.filename.replace('.yaml', '_databricks.yaml').replace('.yml', '_databricks.yml')
+            result.files_processed = 1
+            result.total_cells_rewritten = cells_rewritten
+            result.file_details.append(FileDetail(
+                filename=filename,
+                type='YAML',
+                cells_rewritten=cells_rewritten,
+                size_mb=round(upload_size / 1024 / 1024, 2)
+            ))
             
-            result['processed_file_data'] = {
-                'content': output_yaml,
-                'filename': filename,
-                'mimetype': 'application/x-yaml'
-            }
+            # Convert back to YAML and let libyaml write the encoded bytes straight to disk
+            output_filename = filename.replace('.yaml', '_databricks.yaml').replace('.yml', '_databricks.yml')
             
-            # Analyze conversions
-            result['conversion_summary'] = analyze_conversions(doc, new_doc)
+            file_data = result.processed_file_data = _new_processed_file(output_filename, 'application/x-yaml')
+            with open(file_data.path, 'wb') as f:
+                dump_yaml(new_doc, f, encoding='utf-8')
             
-            # Create final summary
-            final_summary = {
-                'files_processed': result['files_processed'],
-                'cells_rewritten': result['total_cells_rewritten'],
-                'functions_converted': result['conversion_summary'].get('functions_converted', 0),
-                'tables_remapped': result['conversion_summary'].get('tables_remapped', 0)
-            }
-            
-            return jsonify({
-                'success': True,
-                'session_id': session_id,
-                'summary': final_summary
-            })
+            result.conversion_summary = conversion_summary
         
         # Process ZIP file
-        elif file.filename.endswith('.zip'):
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # Extract uploaded ZIP
-                input_dir = os.path.join(temp_dir, 'input')
-                output_dir = os.path.join(temp_dir, 'output')
-                os.makedirs(input_dir)
-                os.makedirs(output_dir)
-                
-                # Save and extract ZIP
-                zip_path = os.path.join(temp_dir, 'upload.zip')
-                file.save(zip_path)
-                
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(input_dir)
-                
-                # Process all YAML files
-                total_functions = 0
-                total_tables = 0
-                
-                for root, dirs, files in os.walk(input_dir):
-                    for filename in files:
-                        if filename.endswith(('.yaml', '.yml')):
-                            input_path = os.path.join(root, filename)
-                            
-                            # Calculate relative path for output
-                            rel_path = os.path.relpath(input_path, input_dir)
-                            output_path = os.path.join(output_dir, rel_path)
-                            
-                            # Create output directory structure
-                            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                            
-                            # Process file
-                            try:
-                                doc = load_yaml(input_path)
-                                new_doc, cells_rewritten = transform_hex_yaml(doc, databricks_conn_id)
-                                
-                                # Save processed file
-                                with open(output_path, 'w') as f:
-                                    yaml.dump(new_doc, f, default_flow_style=False, sort_keys=False)
-                                
-                                # Track file details
-                                file_size = os.path.getsize(input_path) / 1024 / 1024
-                                result['file_details'].append({
-                                    'filename': rel_path,
-                                    'type': 'YAML',
-                                    'cells_rewritten': cells_rewritten,
-                                    'size_mb': round(file_size, 2)
-                                })
-                                
-                                result['files_processed'] += 1
-                                result['total_cells_rewritten'] += cells_rewritten
-                                
-                                # Analyze conversions for this file
-                                file_analysis = analyze_conversions(doc, new_doc)
-                                total_functions += file_analysis.get('functions_converted', 0)
-                                total_tables += file_analysis.get('tables_remapped', 0)
-                                
-                            except Exception as e:
-                                result['errors'].append(f"Error processing {rel_path}: {str(e)}")
-                                print(f"Error processing {rel_path}: {e}")
-                
-                # Create output ZIP in memory
-                output_zip = io.BytesIO()
-                with zipfile.ZipFile(output_zip, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for root, dirs, files in os.walk(output_dir):
-                        for filename in files:
-                            file_path = os.path.join(root, filename)
-                            arc_name = os.path.relpath(file_path, output_dir)
-                            zip_file.write(file_path, arc_name)
-                
-                output_zip.seek(0)
-                
-                # Store ZIP data
-                zip_filename = f'{file.filename.replace(".zip", "")}_databricks.zip'
-                result['processed_file_data'] = {
-                    'content': output_zip.getvalue(),
-                    'filename': zip_filename,
-                    'mimetype': 'application/zip'
-                }
-                
-                result['conversion_summary'] = {
-                    'functions_converted': total_functions,
-                    'tables_remapped': total_tables
-                }
-                
-                return jsonify({
-                    'success': True,
-                    'session_id': session_id,
-                    'summary': {
-                        'files_processed': result['files_processed'],
-                        'cells_rewritten': result['total_cells_rewritten'],
-                        'functions_converted': total_functions,
-                        'tables_remapped': total_tables
-                    }
-                })
-        
         else:
-            return jsonify({'error': 'Unsupported file type. Please upload .yaml, .yml, or .zip files'}), 400
+            # Read entries straight from the uploaded archive and write the
+            # converted YAML directly into the output archive on disk.
+            # Files are independent, so they are converted in parallel and
+            # only this process writes to the output archive.
+            with zipfile.ZipFile(stream, 'r') as zip_ref:
+                items = [
+                    (info.filename, zip_ref.read(info), databricks_conn_id)
+                    for info in zip_ref.infolist()
+                    if not info.is_dir() and info.filename.endswith(('.yaml', '.yml'))
+                ]
+            
+            zip_filename = f'{filename.replace(".zip", "")}_databricks.zip'
+            file_data = result.processed_file_data = _new_processed_file(zip_filename, 'application/zip')
+            
+            # Collect per-file results in locals and write them back to the result once
+            file_details = []
+            errors = []
+            total_cells = 0
+            total_functions = 0
+            total_tables = 0
+            
+            # Level 1 deflate: YAML still compresses well and it's several times faster than the default
+            with zipfile.ZipFile(file_data.path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zip_file:
+                for rel_path, raw_size, output_yaml, cells_rewritten, functions_converted, tables_remapped, error in _convert_entries(items, databricks_conn_id):
+                    if error:
+                        errors.append(f"Error processing {rel_path}: {error}")
+                        print(f"Error processing {rel_path}: {error}")
+                        continue
+                    
+                    # Save processed file
+                    zip_file.writestr(rel_path, output_yaml)
+                    
+                    # Track file details
+                    file_details.append(FileDetail(
+                        filename=rel_path,
+                        type='YAML',
+                        cells_rewritten=cells_rewritten,
+                        size_mb=round(raw_size / 1024 / 1024, 2)
+                    ))
+                    total_cells += cells_rewritten
+                    total_functions += functions_converted
+                    total_tables += tables_remapped
+            
+            result.file_details = file_details
+            result.errors = errors
+            result.files_processed = len(file_details)
+            result.total_cells_rewritten = total_cells
+            result.conversion_summary = {
+                'functions_converted': total_functions,
+                'tables_remapped': total_tables
+            }
+        
+        processing_results[session_id] = result
+    except Exception:
+        _remove_processed_file(result)
+        raise
     
+    # Create final summary
+    conversion_summary = result.conversion_summary
+    return {
+        'files_processed': result.files_processed,
+        'cells_rewritten': result.total_cells_rewritten,
+        'functions_converted': conversion_summary.get('functions_converted', 0),
+        'tables_remapped': conversion_summary.get('tables_remapped', 0)
+    }
+
+if celery:
+    @celery.task(name='hex.process_upload')
+    def process_upload_task(session_id, filename, databricks_conn_id):
+        """Celery entry point: convert an upload stashed in Redis by /upload"""
+        upload_key = f'job:{session_id}:upload'
+        if not redis_client.exists(upload_key):
+            raise RuntimeError('Uploaded file expired before it could be processed')
+        try:
+            # Spool the upload to local disk in chunks; ZIP reading needs a seekable file
+            with tempfile.TemporaryFile() as upload:
+                for chunk in _redis_iter_string(redis_client, upload_key):
+                    upload.write(chunk)
+                upload.seek(0)
+                return process_upload(session_id, upload, filename, databricks_conn_id)
+        finally:
+            redis_client.delete(upload_key)
+
+def _new_processed_file(filename, mimetype):
+    """Create the temp file the processed output is written to, so downloads can be served from disk"""
+    fd, path = tempfile.mkstemp(prefix='hex-migration-', suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    return ProcessedFile(path=path, filename=filename, mimetype=mimetype)
+
+def _remove_processed_file(result):
+    """Delete the processed output file of a processing result"""
+    file_data = result.processed_file_data
+    if file_data:
+        try:
+            os.remove(file_data.path)
+        except OSError:
+            pass
+
+def _process_yaml_entry(item):
+    """Convert one YAML file from an uploaded ZIP (runs in a worker process)"""
+    rel_path, raw, databricks_conn_id = item
+    try:
+        # Files with nothing to migrate are only syntax-checked (no object construction,
+        # transform or dump) and copied through unchanged
+        if not needs_transform(raw):
+            for _ in yaml.parse(raw, Loader=CSafeLoader):
+                pass
+            return rel_path, len(raw), raw, 0, 0, 0, None
+        doc = yaml.load(raw, Loader=CSafeLoader)
+        new_doc, cells_rewritten, conversion_summary = transform_hex_yaml(doc, databricks_conn_id, in_place=True)
+        output_yaml = dump_yaml(new_doc, encoding='utf-8')
+        return (rel_path, len(raw), output_yaml, cells_rewritten,
+                conversion_summary['functions_converted'], conversion_summary['tables_remapped'], None)
     except Exception as e:
-        return jsonify({'error': f'Processing error: {str(e)}'}), 500
+        return rel_path, len(raw), None, 0, 0, 0, str(e)
+
+def _transform_cache_key(raw, databricks_conn_id):
+    return f'xform:{TRANSFORM_FINGERPRINT}:{hashlib.blake2b(raw, digest_size=16).hexdigest()}:{databricks_conn_id}'
 
-def analyze_conversions(original_doc, converted_doc):
-    """Analyze what was converted in the document"""
-    functions_converted = 0
-    tables_remapped = 0
-    
-    # Convert to strings for analysis
-    original_str = str(original_doc).lower()
-    converted_str = str(converted_doc).lower()
-    
-    # Function conversions - look for common Redshift functions
-    function_patterns = ['nvl(', 'ifnull(', 'to_char(', 'strpos(', 'regexp_substr(', 'dateadd(', 'datediff(']
-    for pattern in function_patterns:
-        count = original_str.count(pattern)
-        functions_converted += count
-    
-    # Table remappings - look for schema references
-    schema_patterns = ['prod.', 'prod_', 'staging.', 'dev.', 'warehouse.']
-    for pattern in schema_patterns:
-        count = original_str.count(pattern)
-        tables_remapped += count
-    
-    # If we found nothing, let's do a more aggressive search
-    if functions_converted == 0 and tables_remapped == 0:
-        # If there's SQL content, assume at least some conversion happened
-        if 'select' in original_str or 'from' in original_str or 'where' in original_str:
-            functions_converted = 1
-            tables_remapped = 1
+def _get_cached_transforms(keys):
+    """Look up cached (output, cells, functions, tables) conversions, None for misses"""
+    if not redis_client:
+        return [transform_cache.get(key) for key in keys]
+    pipe = redis_client.pipeline()
+    for key in keys:
+        pipe.hgetall(key)
+    return [
+        (entry[b'output'], int(entry[b'cells']), int(entry[b'functions']), int(entry[b'tables'])) if entry else None
+        for entry in pipe.execute()
+    ]
+
+def _store_cached_transforms(entries):
+    if not redis_client:
+        for key, value in entries.items():
+            transform_cache[key] = value
+        return
+    pipe = redis_client.pipeline()
+    for key, (output, cells, functions, tables) in entries.items():
+        pipe.hset(key, mapping={'output': output, 'cells': cells, 'functions': functions, 'tables': tables})
+        pipe.expire(key, TRANSFORM_CACHE_TTL)
+    pipe.execute()
+
+def _convert_entries(items, databricks_conn_id):
+    """Convert ZIP entries, reusing cached conversions and only sending misses to the workers"""
+    keys = [_transform_cache_key(raw, databricks_conn_id) for _, raw, _ in items]
+    cached = _get_cached_transforms(keys)
+    converted = iter(_map_files(_process_yaml_entry, [item for item, hit in zip(items, cached) if hit is None]))
     
-    return {
-        'functions_converted': functions_converted,
-        'tables_remapped': tables_remapped
-    }
+    entries = []
+    fresh = {}
+    for (rel_path, raw, _), key, hit in zip(items, keys, cached):
+        if hit is None:
+            entry = next(converted)
+            if entry[-1] is None:
+                fresh[key] = entry[2:6]
+        else:
+            entry = (rel_path, len(raw), *hit, None)
+        entries.append(entry)
+    
+    if fresh:
+        _store_cached_transforms(fresh)
+    return entries
+
+def _map_files(func, items):
+    """Map func over items with a process pool, falling back to serial processing"""
+    # Daemonic processes (e.g. Celery prefork workers) can't start a pool of their own
+    if len(items) > 1 and not multiprocessing.current_process().daemon:
+        try:
+            workers = min(os.cpu_count() or 1, len(items))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Hand out several files per task so pickling/IPC overhead is amortized
+                chunksize = max(1, len(items) // (4 * workers))
+                return list(executor.map(func, items, chunksize=chunksize))
+        except (OSError, NotImplementedError) as e:
+            # Some serverless runtimes (e.g. Vercel) don't support multiprocessing
+            print(f"⚠️  Process pool unavailable, processing files serially: {e}")
+    return [func(item) for item in items]
+
+def _attachment_filenames(filename):
+    """Content-Disposition filename parameters, built the way werkzeug's send_file does.
+    
+    Non-ASCII names get an ASCII-folded filename plus an RFC 5987 filename*, since
+    header values must be Latin-1 on the wire.
+    """
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        quoted = quote(filename, safe="!#$&+-.^_`|~")
+        return {'filename': simple, 'filename*': f"UTF-8''{quoted}"}
+    return {'filename': filename}
 
 @app.route('/download/<session_id>')
 def download_file(session_id):
-    if session_id not in processing_results:
+    result = processing_results.get(session_id)
+    if result is None:
         return jsonify({'error': 'Session not found or expired'}), 404
     
-    result = processing_results[session_id]
-    file_data = result['processed_file_data']
-    
+    file_data = result.processed_file_data
     if not file_data:
         return jsonify({'error': 'No processed file available'}), 404
     
-    # Create file-like object
-    output = io.BytesIO(file_data['content'] if isinstance(file_data['content'], bytes) else file_data['content'].encode('utf-8'))
-    output.seek(0)
+    if redis_client:
+        size = processing_results.blob_size(session_id)
+        if not size:
+            return jsonify({'error': 'Session not found or expired'}), 404
+        
+        # Stream the file out of Redis in chunks as it is sent
+        response = Response(processing_results.iter_blob(session_id), mimetype=file_data.mimetype)
+        response.content_length = size
+        response.headers.set('Content-Disposition', 'attachment', **_attachment_filenames(file_data.filename))
+        return response
+    
+    if not os.path.exists(file_data.path):
+        return jsonify({'error': 'Session not found or expired'}), 404
     
+    # Stream from disk; werkzeug uses the server's file wrapper / X-Sendfile when available
     return send_file(
-        output,
-        mimetype=file_data['mimetype'],
+        file_data.path,
+        mimetype=file_data.mimetype,
         as_attachment=True,
-        download_name=file_data['filename']
+        download_name=file_data.filename,
+        conditional=True
     )
 
 @app.route('/results/<session_id>')
 def get_results(session_id):
-    if session_id not in processing_results:
+    result = processing_results.get(session_id)
+    if result is None:
+        if celery:
+            # Report progress of an upload that is still queued or running on a worker
+            task = celery.AsyncResult(session_id)
+            if task.state == 'FAILURE':
+                return jsonify({'status': task.state, 'error': f'Processing error: {task.result}'}), 500
+            # Celery reports PENDING for any unknown id, so only trust it while the
+            # stashed upload is still waiting for (or being processed by) a worker
+            if task.state in ('PENDING', 'STARTED', 'RETRY') and redis_client.exists(f'job:{session_id}:upload'):
+                return jsonify({'status': task.state}), 202
         return jsonify({'error': 'Session not found or expired'}), 404
     
-    result = processing_results[session_id]
-    
     # Return detailed results without the file data
     return jsonify({
-        'timestamp': result['timestamp'],
-        'original_filename': result['original_filename'],
-        'databricks_conn_id': result['databricks_conn_id'],
-        'files_processed': result['files_processed'],
-        'total_cells_rewritten': result['total_cells_rewritten'],
-        'functions_converted': result['conversion_summary'].get('functions_converted', 0),
-        'tables_remapped': result['conversion_summary'].get('tables_remapped', 0),
-        'file_details': result['file_details'],
-        'warnings': result['warnings'],
-        'errors': result['errors'],
-        'has_download': result['processed_file_data'] is not None
+        'status': 'SUCCESS',
+        'timestamp': result.timestamp,
+        'original_filename': result.original_filename,
+        'databricks_conn_id': result.databricks_conn_id,
+        'files_processed': result.files_processed,
+        'total_cells_rewritten': result.total_cells_rewritten,
+        'functions_converted': result.conversion_summary.get('functions_converted', 0),
+        'tables_remapped': result.conversion_summary.get('tables_remapped', 0),
+        'file_details': [asdict(file_detail) for file_detail in result.file_details],
+        'warnings': result.warnings,
+        'errors': result.errors,
+        'has_download': result.processed_file_data is not None
     })
 
 @app.route('/export/<session_id>')
 def export_to_csv(session_id):
-    if session_id not in processing_results:
+    result = processing_results.get(session_id)
+    if result is None:
         return jsonify({'error': 'Session not found or expired'}), 404
     
-    result = processing_results[session_id]
-    
-    # Create CSV data for Google Sheets import
-    csv_data = "Metric,Value\n"
-    csv_data += f"Processing Date,{result['timestamp']}\n"
-    csv_data += f"Original Filename,{result['original_filename']}\n"
-    csv_data += f"Databricks Connection ID,{result['databricks_conn_id']}\n"
-    csv_data += f"Files Processed,{result['files_processed']}\n"
-    csv_data += f"Total Cells Rewritten,{result['total_cells_rewritten']}\n"
-    csv_data += f"Functions Converted,{result['conversion_summary'].get('functions_converted', 0)}\n"
-    csv_data += f"Tables Remapped,{result['conversion_summary'].get('tables_remapped', 0)}\n"
-    csv_data += "\nFile Details:\n"
-    csv_data += "Filename,Type,Cells Rewritten,Size (MB)\n"
-    
-    for file_detail in result['file_details']:
-        csv_data += f"{file_detail['filename']},{file_detail['type']},{file_detail['cells_rewritten']},{file_detail['size_mb']}\n"
+    # Create CSV data for Google Sheets import, encoding rows straight into the response buffer
+    output = io.BytesIO()
+    buffer = io.TextIOWrapper(output, encoding='utf-8', newline='')
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(['Metric', 'Value'])
+    writer.writerows([
+        ['Processing Date', result.timestamp],
+        ['Original Filename', result.original_filename],
+        ['Databricks Connection ID', result.databricks_conn_id],
+        ['Files Processed', result.files_processed],
+        ['Total Cells Rewritten', result.total_cells_rewritten],
+        ['Functions Converted', result.conversion_summary.get('functions_converted', 0)],
+        ['Tables Remapped', result.conversion_summary.get('tables_remapped', 0)]
+    ])
+    writer.writerow([])
+    writer.writerow(['File Details:'])
+    writer.writerow(['Filename', 'Type', 'Cells Rewritten', 'Size (MB)'])
+    writer.writerows(
+        [file_detail.filename, file_detail.type, file_detail.cells_rewritten, file_detail.size_mb]
+        for file_detail in result.file_details
+    )
     
-    output = io.BytesIO(csv_data.encode('utf-8'))
-    output.seek(0)
+    buffer.detach()  # flushes the encoded rows into output and leaves it open
     
-    return send_file(
-        output,
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f"migration_report_{session_id[:8]}.csv"
-    )
+    # A plain response (unlike send_file's passthrough) can be compressed on the way out
+    response = Response(output.getvalue(), mimetype='text/csv')
+    response.headers.set('Content-Disposition', 'attachment', filename=f"migration_report_{session_id[:8]}.csv")
+    return response
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
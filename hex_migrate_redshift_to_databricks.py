@@ -41,7 +41,12 @@ import sys
 import re
 import os
 import csv
-from copy import deepcopy
+import codecs
+import heapq
+from bisect import bisect_left
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
 
 try:
     import yaml  # PyYAML
@@ -49,21 +54,32 @@ except Exception as e:
     print("This script requires PyYAML. pip install pyyaml", file=sys.stderr)
     raise
 
+# Use the libyaml C bindings when PyYAML was built with them
+CSafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+CSafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+if not yaml.__with_libyaml__:
+    print("⚠️  PyYAML was built without libyaml - YAML I/O will be slow. Reinstall with libyaml headers present:"
+          " pip install --force-reinstall --no-binary pyyaml pyyaml", file=sys.stderr)
+
 # ---------- 1) Load Schema/Catalog mapping from CSV ----------
 def load_schema_mappings(csv_path="hex_yamls/schema-dialects/Redshift to Databricks Migration Mapping - Schema Mapping.csv"):
     """Load schema mappings from CSV file - supports both old and new formats"""
     schema_map = {}
     try:
         with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            headers = reader.fieldnames
+            reader = csv.reader(f)
+            headers = next(reader)
             
             # Check if this is the new table-to-table format
             if 'Redshift Table' in headers and 'Databricks Table' in headers:
                 print(f"📋 Loading table-to-table mappings from {csv_path}")
+                i_table = headers.index('Redshift Table')
+                i_target = headers.index('Databricks Table')
                 for row in reader:
-                    redshift_table = row['Redshift Table'].strip()
-                    databricks_table = row['Databricks Table'].strip()
+                    if not row:
+                        continue
+                    redshift_table = row[i_table].strip()
+                    databricks_table = row[i_target].strip()
                     
                     if redshift_table and databricks_table:
                         schema_map[redshift_table.lower()] = databricks_table
@@ -74,11 +90,17 @@ def load_schema_mappings(csv_path="hex_yamls/schema-dialects/Redshift to Databri
             # Old format: Redshift Database/Schema -> Databricks Catalog/Schema
             elif 'Redshift Database' in headers and 'Redshift Schema' in headers:
                 print(f"📋 Loading schema mappings from {csv_path}")
+                i_db = headers.index('Redshift Database')
+                i_schema = headers.index('Redshift Schema')
+                i_catalog = headers.index('Databricks Catalog')
+                i_target_schema = headers.index('Databricks Schema')
                 for row in reader:
-                    redshift_db = row['Redshift Database'].strip()
-                    redshift_schema = row['Redshift Schema'].strip()
-                    databricks_catalog = row['Databricks Catalog'].strip()
-                    databricks_schema = row['Databricks Schema'].strip()
+                    if not row:
+                        continue
+                    redshift_db = row[i_db].strip()
+                    redshift_schema = row[i_schema].strip()
+                    databricks_catalog = row[i_catalog].strip()
+                    databricks_schema = row[i_target_schema].strip()
                     
                     key = (redshift_db.lower(), redshift_schema.lower())
                     value = (databricks_catalog, databricks_schema if databricks_schema != '*' else '*')
@@ -99,218 +121,232 @@ def load_schema_mappings(csv_path="hex_yamls/schema-dialects/Redshift to Databri
         print("⚠️  Using hardcoded schema mappings as fallback")
         return get_hardcoded_schema_map()
 
+# Fallback schema mappings as compact (database, schema, catalog, schema) rows;
+# only turned into a dict when the CSV can't be loaded
+HARDCODED_SCHEMA_MAPPINGS = (
+    ("prod", "archive", "archive", "*"),
+    ("prod", "prod_reference", "reference", "*"),
+    ("prod", "prod_algolia_target", "reference", "algolia_target"),
+    ("prod", "census", "metadata", "census"),
+    ("prod", "looker_scratch", "metadata", "looker_scratch"),
+    ("prod", "looker_tmp", "metadata", "looker_tmp"),
+    ("prod", "prod_data_quality", "metadata", "data_quality"),
+    ("prod", "prod_dbt_test__audit", "metadata", "dbt_test__audit"),
+    ("prod", "prod_elementary", "metadata", "elementary"),
+    ("prod", "raw_adroll", "source", "adroll"),
+    ("prod", "raw_analytics_api_external", "source", "analytics_api"),
+    ("prod", "raw_bamboohr", "source", "bamboohr"),
+    ("prod", "raw_bing_ads", "source", "bing_ads"),
+    ("prod", "raw_connectivity_api__eu", "source", "connectivity_api__eu"),
+    ("prod", "raw_connectivity_api__us", "source", "connectivity_api__us"),
+    ("prod", "raw_connectivity_api_observability__eu", "source", "connectivity_api_observability__eu"),
+    ("prod", "raw_connectivity_api_observability__us", "source", "connectivity_api_observability__us"),
+    ("prod", "raw_crossbeam", "source", "crossbeam"),
+    ("prod", "raw_dashboard", "source", "dashboard"),
+    ("prod", "raw_demandbase", "source", "demandbase"),
+    ("prod", "raw_einstein", "source", "einstein"),
+    ("prod", "raw_ethical_ads", "source", "ethical_ads"),
+    ("prod", "raw_ethical_ads_v2", "source", "ethical_ads_v2"),
+    ("prod", "raw_events_external", "source", "events"),
+    ("prod", "raw_facebook", "source", "facebook"),
+    ("prod", "raw_facebook_ads", "source", "facebook_ads"),
+    ("prod", "raw_feature_personalization_ai", "source", "feature_personalization_ai"),
+    ("prod", "raw_feature_personalization_classic", "source", "feature_personalization_classic"),
+    ("prod", "raw_feature_query_categorization", "source", "feature_query_categorization"),
+    ("prod", "raw_feature_query_categorization_archive_external", "source", "feature_query_categorization_archive"),
+    ("prod", "raw_feature_query_categorization_external", "source", "feature_query_categorization"),
+    ("prod", "raw_gainsight", "source", "gainsight"),
+    ("prod", "raw_galileo", "source", "galileo"),
+    ("prod", "raw_github", "source", "github"),
+    ("prod", "raw_github_external", "source", "github"),
+    ("prod", "raw_google_ads", "source", "google_ads"),
+    ("prod", "raw_google_analytics", "source", "google_analytics"),
+    ("prod", "raw_google_analytics_4", "source", "google_analytics_4"),
+    ("prod", "raw_google_sheets", "source", "google_sheets"),
+    ("prod", "raw_helpscout", "source", "helpscout"),
+    ("prod", "raw_infrastructure", "source", "infrastructure"),
+    ("prod", "raw_infrastructure_costs", "source", "infrastructure_costs"),
+    ("prod", "raw_jira", "source", "jira"),
+    ("prod", "raw_linkedin_ads", "source", "linkedin_ads"),
+    ("prod", "raw_marketo", "archive", "marketo"),
+    ("prod", "raw_marketo_v2", "source", "marketo_v2"),
+    ("prod", "raw_npm", "source", "npm"),
+    ("prod", "raw_pigment", "source", "pigment"),
+    ("prod", "raw_product", "source", "product"),
+    ("prod", "raw_product_external", "source", "product"),
+    ("prod", "product", "source", "product"),
+    ("prod", "raw_realm_b2b", "source", "realm_b2b"),
+    ("prod", "raw_redshift_monitoring", "source", "redshift_monitoring"),
+    ("prod", "raw_redshift_monitoring_external", "source", "redshift_monitoring"),
+    ("prod", "raw_revenue", "source", "revenue"),
+    ("prod", "revenue", "source", "revenue"),
+    ("prod", "raw_salesforce", "source", "salesforce"),
+    ("prod", "raw_shopify", "source", "shopify"),
+    ("prod", "shopify", "source", "shopify"),
+    ("prod", "raw_stripe_eu", "source", "stripe_eu"),
+    ("prod", "raw_stripe_eu_backup", "source", "stripe_eu_backup"),
+    ("prod", "raw_stripe_us", "source", "stripe_us"),
+    ("prod", "raw_stripe_us_backup", "source", "stripe_us_backup"),
+    ("prod", "raw_telemetry", "source", "telemetry"),
+    ("prod", "raw_toggl", "source", "toggl"),
+    ("prod", "raw_twitter_ads", "source", "twitter_ads"),
+    ("prod", "raw_usage_api_external", "source", "usage_api"),
+    ("prod", "raw_usages_rest_api", "source", "usages_rest_api"),
+    ("prod", "usages", "source", "usages"),
+    ("prod", "raw_rolling_month_per_application", "source", "usages"),
+    ("prod", "raw_zendesk", "source", "zendesk"),
+    ("prod", "raw_zendesk_test_stitch", "source", "zendesk_test_stitch"),
+    ("prod", "raw_zuora", "source", "zuora"),
+    ("prod", "segment_recommend_worker_back_end", "source", "segment_recommend_worker_back_end"),
+    ("prod", "segment_algolia", "source", "segment_algolia"),
+    ("prod", "segment_algolia_blog", "source", "segment_algolia_blog"),
+    ("prod", "segment_algolia_community", "source", "segment_algolia_community"),
+    ("prod", "segment_algolia_dashboard_backend", "source", "segment_algolia_dashboard_backend"),
+    ("prod", "segment_algolia_dashboard_frontend", "source", "segment_algolia_dashboard_frontend"),
+    ("prod", "segment_algolia_documentation", "source", "segment_algolia_documentation"),
+    ("prod", "segment_cli_dev", "source", "segment_cli_dev"),
+    ("prod", "segment_collections_dev", "source", "segment_collections_dev"),
+    ("prod", "segment_collections_prod", "source", "segment_collections_prod"),
+    ("prod", "segment_crawler", "source", "segment_crawler"),
+    ("prod", "segment_design_system_a11y", "source", "segment_design_system_a11y"),
+    ("prod", "segment_design_system_static_usage", "source", "segment_design_system_static_usage"),
+    ("prod", "segment_magento", "source", "segment_magento"),
+    ("prod", "segment_new_world_docs", "source", "segment_new_world_docs"),
+    ("prod", "segment_partners_algolia", "source", "segment_partners_algolia"),
+    ("prod", "segment_recommend_doc_prod", "source", "segment_recommend_doc_prod"),
+    ("prod", "segment_search_grader", "source", "segment_search_grader"),
+    ("prod", "segment_shopify", "source", "segment_shopify"),
+    ("prod", "segment_shopify_admin", "source", "segment_shopify_admin"),
+    ("prod", "segment_static", "source", "segment_static"),
+    ("prod", "segment_support_prod", "source", "segment_support_prod"),
+    ("prod", "segment_bigcommerce_integration_prod", "source", "segment_bigcommerce_integration_prod"),
+    ("prod", "segment_prod_events_records_connections", "source", "segment_prod_events_records_connections"),
+    ("prod", "segment_events_records_connections_staging", "source", "segment_events_records_connections_staging"),
+    ("prod", "events", "tracked_features_events", None),
+    ("prod", "prod_analytics_api", "data_engineering_staging", "analytics_api"),
+    ("prod", "prod_analytics_api_external", "data_engineering_staging", "analytics_api"),
+    ("prod", "prod_application", "data_engineering_staging", "application"),
+    ("prod", "prod_application_intermediate_feature_logs_stats_external", "data_engineering_staging", "application"),
+    ("prod", "prod_application_intermediate_insights_logs_stats_external", "data_engineering_staging", "application"),
+    ("prod", "prod_product", "data_engineering_staging", "product"),
+    ("prod", "prod_product_daily_recommend_operations_per_user_agent_external", "data_engineering_staging", "product"),
+    ("prod", "prod_product_external", "data_engineering_staging", "product"),
+    ("prod", "prod_product_indices_replicas_and_primaries_external", "data_engineering_staging", "product"),
+    ("prod", "prod_product_insights_daily_user_tokens_per_application_external", "data_engineering_staging", "product"),
+    ("prod", "prod_product_intermediate_feature_logs_stats_by_cluster_external", "data_engineering_staging", "product"),
+    ("prod", "prod_product_intermediate_feature_logs_stats_by_index_external", "data_engineering_staging", "product"),
+    ("prod", "prod_dashboard", "source", "dashboard"),
+    ("prod", "prod_salesforce", "data_engineering_staging", "salesforce"),
+    ("prod", "prod_usage_quotas", "data_engineering_staging", "usages"),
+    ("prod", "prod_usages", "data_engineering_staging", "usages"),
+    ("prod", "prod_usages_daily_per_application_per_index_external", "data_engineering_staging", "usages"),
+    ("prod", "prod_usages_intermediate_bigtable_daily_per_application_external", "data_engineering_staging", "usages"),
+    ("prod", "prod_usages_intermediate_bigtable_daily_per_application_per_index_external", "data_engineering_staging", "usages"),
+    ("prod", "prod_usages_intermediate_bigtable_daily_per_application_per_index_rowkeys_external", "data_engineering_staging", "usages"),
+    ("prod", "prod_usages_intermediate_bigtable_daily_per_application_rowkeys_external", "data_engineering_staging", "usages"),
+    ("prod", "prod_usages_intermediate_daily_per_application_merged_with_legacy_external", "data_engineering_staging", "usages"),
+    ("prod", "prod_usages_intermediate_daily_per_application_per_index_external", "data_engineering_staging", "usages"),
+    ("prod", "prod_usages_intermediate_daily_per_application_per_index_max_rowkeys_external", "data_engineering_staging", "usages"),
+    ("prod", "prod_usages_intermediate_indices_settings_metrics_per_application_external", "data_engineering_staging", "usages"),
+    ("prod", "prod_user", "data_engineering_staging", "user"),
+    ("prod", "prod_common", "standardized", "common"),
+    ("prod", "prod_dimensional", "analytics", "dimensional"),
+    ("prod", "prod_helpscout", "staging", "helpscout"),
+    ("prod", "prod_infrastructure", "staging", "infrastructure"),
+    ("prod", "prod_staging_bamboohr", "staging", "bamboohr"),
+    ("prod", "prod_staging_bing_ads", "staging", "bing_ads"),
+    ("prod", "prod_staging_dashboard", "staging", "dashboard"),
+    ("prod", "prod_staging_demandbase", "staging", "demandbase"),
+    ("prod", "prod_staging_ethical_ads", "staging", "ethical_ads"),
+    ("prod", "prod_staging_facebook_ads", "staging", "facebook_ads"),
+    ("prod", "prod_staging_gainsight", "staging", "gainsight"),
+    ("prod", "prod_staging_google_ads", "staging", "google_ads"),
+    ("prod", "prod_staging_google_analytics", "staging", "google_analytics"),
+    ("prod", "prod_staging_infrastructure", "staging", "infrastructure"),
+    ("prod", "prod_staging_jira", "staging", "jira"),
+    ("prod", "prod_staging_linkedin_ads", "staging", "linkedin_ads"),
+    ("prod", "prod_staging_pigment", "staging", "pigment"),
+    ("prod", "prod_staging_product", "staging", "product"),
+    ("prod", "prod_staging_realm_b2b", "staging", "realm_b2b"),
+    ("prod", "prod_staging_revenue", "staging", "revenue"),
+    ("prod", "prod_staging_rollworks", "staging", "rollworks"),
+    ("prod", "prod_staging_salesforce", "staging", "salesforce"),
+    ("prod", "prod_staging_search", "staging", "search"),
+    ("prod", "prod_staging_segment", "staging", "segment"),
+    ("prod", "prod_staging_toggl", "staging", "toggl"),
+    ("prod", "prod_staging_twitter_ads", "staging", "twitter_ads"),
+    ("prod", "prod_staging_usage", "staging", "usage"),
+    ("prod", "prod_staging_zendesk", "staging", "zendesk"),
+    ("prod", "prod_mart_algolia", "mart", "algolia"),
+    ("prod", "prod_analytics", "mart", "algolia"),
+    ("prod", "prod_analytics_daily_aggregations_external", "mart", "algolia"),
+    ("prod", "prod_analytics_intermediate_query_categorization_metadata_logs_external", "mart", "algolia"),
+    ("prod", "prod_analytics_intermediate_search_aggregates_conversions_stats_external", "mart", "algolia"),
+    ("prod", "prod_analytics_intermediate_search_aggregates_logs_stats_external", "mart", "algolia"),
+    ("prod", "prod_analytics_intermediate_search_aggregates_searches_stats_external", "mart", "algolia"),
+    ("prod", "prod_analytics_intermediate_search_slg_search_aggregate_external", "mart", "algolia"),
+    ("prod", "prod_mart_customer_success", "mart", "customer_success"),
+    ("prod", "prod_mart_customer_support", "mart", "customer_support"),
+    ("prod", "prod_mart_finance", "mart", "finance"),
+    ("prod", "prod_mart_growth", "mart", "growth"),
+    ("prod", "prod_mart_marketing", "mart", "marketing"),
+    ("prod", "prod_mart_professional_services", "mart", "professional_services"),
+    ("prod", "prod_mart_sales", "mart", "sales"),
+    ("prod", "prod_reverse_etl_amplitude", "reverse_etl", "amplitude"),
+    ("prod", "prod_reverse_etl_endgame", "reverse_etl", "endgame"),
+    ("prod", "prod_reverse_etl_gainsight", "reverse_etl", "gainsight"),
+    ("prod", "prod_reverse_etl_headsup", "reverse_etl", "headsup"),
+    ("prod", "prod_reverse_etl_marketo", "reverse_etl", "marketo"),
+    ("prod", "prod_reverse_etl_salesforce", "reverse_etl", "salesforce"),
+    ("prod", "prod_reverse_etl_zendesk", "reverse_etl", "zendesk"),
+)
+
 def get_hardcoded_schema_map():
     """Fallback hardcoded schema mappings"""
-    return {
-        ("prod", "archive"): ("archive", "*"),
-        ("prod", "prod_reference"): ("reference", "*"),
-        ("prod", "prod_algolia_target"): ("reference", "algolia_target"),
-        ("prod", "census"): ("metadata", "census"),
-        ("prod", "looker_scratch"): ("metadata", "looker_scratch"),
-        ("prod", "looker_tmp"): ("metadata", "looker_tmp"),
-        ("prod", "prod_data_quality"): ("metadata", "data_quality"),
-        ("prod", "prod_dbt_test__audit"): ("metadata", "dbt_test__audit"),
-        ("prod", "prod_elementary"): ("metadata", "elementary"),
-        ("prod", "raw_adroll"): ("source", "adroll"),
-        ("prod", "raw_analytics_api_external"): ("source", "analytics_api"),
-        ("prod", "raw_bamboohr"): ("source", "bamboohr"),
-        ("prod", "raw_bing_ads"): ("source", "bing_ads"),
-        ("prod", "raw_connectivity_api__eu"): ("source", "connectivity_api__eu"),
-        ("prod", "raw_connectivity_api__us"): ("source", "connectivity_api__us"),
-        ("prod", "raw_connectivity_api_observability__eu"): ("source", "connectivity_api_observability__eu"),
-        ("prod", "raw_connectivity_api_observability__us"): ("source", "connectivity_api_observability__us"),
-        ("prod", "raw_crossbeam"): ("source", "crossbeam"),
-        ("prod", "raw_dashboard"): ("source", "dashboard"),
-        ("prod", "raw_demandbase"): ("source", "demandbase"),
-        ("prod", "raw_einstein"): ("source", "einstein"),
-        ("prod", "raw_ethical_ads"): ("source", "ethical_ads"),
-        ("prod", "raw_ethical_ads_v2"): ("source", "ethical_ads_v2"),
-        ("prod", "raw_events_external"): ("source", "events"),
-        ("prod", "raw_facebook"): ("source", "facebook"),
-        ("prod", "raw_facebook_ads"): ("source", "facebook_ads"),
-        ("prod", "raw_feature_personalization_ai"): ("source", "feature_personalization_ai"),
-        ("prod", "raw_feature_personalization_classic"): ("source", "feature_personalization_classic"),
-        ("prod", "raw_feature_query_categorization"): ("source", "feature_query_categorization"),
-        ("prod", "raw_feature_query_categorization_archive_external"): ("source", "feature_query_categorization_archive"),
-        ("prod", "raw_feature_query_categorization_external"): ("source", "feature_query_categorization"),
-        ("prod", "raw_gainsight"): ("source", "gainsight"),
-        ("prod", "raw_galileo"): ("source", "galileo"),
-        ("prod", "raw_github"): ("source", "github"),
-        ("prod", "raw_github_external"): ("source", "github"),
-        ("prod", "raw_google_ads"): ("source", "google_ads"),
-        ("prod", "raw_google_analytics"): ("source", "google_analytics"),
-        ("prod", "raw_google_analytics_4"): ("source", "google_analytics_4"),
-        ("prod", "raw_google_sheets"): ("source", "google_sheets"),
-        ("prod", "raw_helpscout"): ("source", "helpscout"),
-        ("prod", "raw_infrastructure"): ("source", "infrastructure"),
-        ("prod", "raw_infrastructure_costs"): ("source", "infrastructure_costs"),
-        ("prod", "raw_jira"): ("source", "jira"),
-        ("prod", "raw_linkedin_ads"): ("source", "linkedin_ads"),
-        ("prod", "raw_marketo"): ("archive", "marketo"),
-        ("prod", "raw_marketo_v2"): ("source", "marketo_v2"),
-        ("prod", "raw_npm"): ("source", "npm"),
-        ("prod", "raw_pigment"): ("source", "pigment"),
-        ("prod", "raw_product"): ("source", "product"),
-        ("prod", "raw_product_external"): ("source", "product"),
-        ("prod", "product"): ("source", "product"),
-        ("prod", "raw_realm_b2b"): ("source", "realm_b2b"),
-        ("prod", "raw_redshift_monitoring"): ("source", "redshift_monitoring"),
-        ("prod", "raw_redshift_monitoring_external"): ("source", "redshift_monitoring"),
-        ("prod", "raw_revenue"): ("source", "revenue"),
-        ("prod", "revenue"): ("source", "revenue"),
-        ("prod", "raw_salesforce"): ("source", "salesforce"),
-        ("prod", "raw_shopify"): ("source", "shopify"),
-        ("prod", "shopify"): ("source", "shopify"),
-        ("prod", "raw_stripe_eu"): ("source", "stripe_eu"),
-        ("prod", "raw_stripe_eu_backup"): ("source", "stripe_eu_backup"),
-        ("prod", "raw_stripe_us"): ("source", "stripe_us"),
-        ("prod", "raw_stripe_us_backup"): ("source", "stripe_us_backup"),
-        ("prod", "raw_telemetry"): ("source", "telemetry"),
-        ("prod", "raw_toggl"): ("source", "toggl"),
-        ("prod", "raw_twitter_ads"): ("source", "twitter_ads"),
-        ("prod", "raw_usage_api_external"): ("source", "usage_api"),
-        ("prod", "raw_usages_rest_api"): ("source", "usages_rest_api"),
-        ("prod", "usages"): ("source", "usages"),
-        ("prod", "raw_rolling_month_per_application"): ("source", "usages"),
-        ("prod", "raw_zendesk"): ("source", "zendesk"),
-        ("prod", "raw_zendesk_test_stitch"): ("source", "zendesk_test_stitch"),
-        ("prod", "raw_zuora"): ("source", "zuora"),
-        ("prod", "segment_recommend_worker_back_end"): ("source", "segment_recommend_worker_back_end"),
-        ("prod", "segment_algolia"): ("source", "segment_algolia"),
-        ("prod", "segment_algolia_blog"): ("source", "segment_algolia_blog"),
-        ("prod", "segment_algolia_community"): ("source", "segment_algolia_community"),
-        ("prod", "segment_algolia_dashboard_backend"): ("source", "segment_algolia_dashboard_backend"),
-        ("prod", "segment_algolia_dashboard_frontend"): ("source", "segment_algolia_dashboard_frontend"),
-        ("prod", "segment_algolia_documentation"): ("source", "segment_algolia_documentation"),
-        ("prod", "segment_cli_dev"): ("source", "segment_cli_dev"),
-        ("prod", "segment_collections_dev"): ("source", "segment_collections_dev"),
-        ("prod", "segment_collections_prod"): ("source", "segment_collections_prod"),
-        ("prod", "segment_crawler"): ("source", "segment_crawler"),
-        ("prod", "segment_design_system_a11y"): ("source", "segment_design_system_a11y"),
-        ("prod", "segment_design_system_static_usage"): ("source", "segment_design_system_static_usage"),
-        ("prod", "segment_magento"): ("source", "segment_magento"),
-        ("prod", "segment_new_world_docs"): ("source", "segment_new_world_docs"),
-        ("prod", "segment_partners_algolia"): ("source", "segment_partners_algolia"),
-        ("prod", "segment_recommend_doc_prod"): ("source", "segment_recommend_doc_prod"),
-        ("prod", "segment_search_grader"): ("source", "segment_search_grader"),
-        ("prod", "segment_shopify"): ("source", "segment_shopify"),
-        ("prod", "segment_shopify_admin"): ("source", "segment_shopify_admin"),
-        ("prod", "segment_static"): ("source", "segment_static"),
-        ("prod", "segment_support_prod"): ("source", "segment_support_prod"),
-        ("prod", "segment_bigcommerce_integration_prod"): ("source", "segment_bigcommerce_integration_prod"),
-        ("prod", "segment_prod_events_records_connections"): ("source", "segment_prod_events_records_connections"),
-        ("prod", "segment_events_records_connections_staging"): ("source", "segment_events_records_connections_staging"),
-        ("prod", "events"): ("tracked_features_events", None),
-        ("prod", "prod_analytics_api"): ("data_engineering_staging", "analytics_api"),
-        ("prod", "prod_analytics_api_external"): ("data_engineering_staging", "analytics_api"),
-        ("prod", "prod_application"): ("data_engineering_staging", "application"),
-        ("prod", "prod_application_intermediate_feature_logs_stats_external"): ("data_engineering_staging", "application"),
-        ("prod", "prod_application_intermediate_insights_logs_stats_external"): ("data_engineering_staging", "application"),
-        ("prod", "prod_product"): ("data_engineering_staging", "product"),
-        ("prod", "prod_product_daily_recommend_operations_per_user_agent_external"): ("data_engineering_staging", "product"),
-        ("prod", "prod_product_external"): ("data_engineering_staging", "product"),
-        ("prod", "prod_product_indices_replicas_and_primaries_external"): ("data_engineering_staging", "product"),
-        ("prod", "prod_product_insights_daily_user_tokens_per_application_external"): ("data_engineering_staging", "product"),
-        ("prod", "prod_product_intermediate_feature_logs_stats_by_cluster_external"): ("data_engineering_staging", "product"),
-        ("prod", "prod_product_intermediate_feature_logs_stats_by_index_external"): ("data_engineering_staging", "product"),
-        ("prod", "prod_dashboard"): ("source", "dashboard"),
-        ("prod", "prod_salesforce"): ("data_engineering_staging", "salesforce"),
-        ("prod", "prod_usage_quotas"): ("data_engineering_staging", "usages"),
-        ("prod", "prod_usages"): ("data_engineering_staging", "usages"),
-        ("prod", "prod_usages_daily_per_application_per_index_external"): ("data_engineering_staging", "usages"),
-        ("prod", "prod_usages_intermediate_bigtable_daily_per_application_external"): ("data_engineering_staging", "usages"),
-        ("prod", "prod_usages_intermediate_bigtable_daily_per_application_per_index_external"): ("data_engineering_staging", "usages"),
-        ("prod", "prod_usages_intermediate_bigtable_daily_per_application_per_index_rowkeys_external"): ("data_engineering_staging", "usages"),
-        ("prod", "prod_usages_intermediate_bigtable_daily_per_application_rowkeys_external"): ("data_engineering_staging", "usages"),
-        ("prod", "prod_usages_intermediate_daily_per_application_merged_with_legacy_external"): ("data_engineering_staging", "usages"),
-        ("prod", "prod_usages_intermediate_daily_per_application_per_index_external"): ("data_engineering_staging", "usages"),
-        ("prod", "prod_usages_intermediate_daily_per_application_per_index_max_rowkeys_external"): ("data_engineering_staging", "usages"),
-        ("prod", "prod_usages_intermediate_indices_settings_metrics_per_application_external"): ("data_engineering_staging", "usages"),
-        ("prod", "prod_user"): ("data_engineering_staging", "user"),
-        ("prod", "prod_common"): ("standardized", "common"),
-        ("prod", "prod_dimensional"): ("analytics", "dimensional"),
-        ("prod", "prod_helpscout"): ("staging", "helpscout"),
-        ("prod", "prod_infrastructure"): ("staging", "infrastructure"),
-        ("prod", "prod_staging_bamboohr"): ("staging", "bamboohr"),
-        ("prod", "prod_staging_bing_ads"): ("staging", "bing_ads"),
-        ("prod", "prod_staging_dashboard"): ("staging", "dashboard"),
-        ("prod", "prod_staging_demandbase"): ("staging", "demandbase"),
-        ("prod", "prod_staging_ethical_ads"): ("staging", "ethical_ads"),
-        ("prod", "prod_staging_facebook_ads"): ("staging", "facebook_ads"),
-        ("prod", "prod_staging_gainsight"): ("staging", "gainsight"),
-        ("prod", "prod_staging_google_ads"): ("staging", "google_ads"),
-        ("prod", "prod_staging_google_analytics"): ("staging", "google_analytics"),
-        ("prod", "prod_staging_infrastructure"): ("staging", "infrastructure"),
-        ("prod", "prod_staging_jira"): ("staging", "jira"),
-        ("prod", "prod_staging_linkedin_ads"): ("staging", "linkedin_ads"),
-        ("prod", "prod_staging_pigment"): ("staging", "pigment"),
-        ("prod", "prod_staging_product"): ("staging", "product"),
-        ("prod", "prod_staging_realm_b2b"): ("staging", "realm_b2b"),
-        ("prod", "prod_staging_revenue"): ("staging", "revenue"),
-        ("prod", "prod_staging_rollworks"): ("staging", "rollworks"),
-        ("prod", "prod_staging_salesforce"): ("staging", "salesforce"),
-        ("prod", "prod_staging_search"): ("staging", "search"),
-        ("prod", "prod_staging_segment"): ("staging", "segment"),
-        ("prod", "prod_staging_toggl"): ("staging", "toggl"),
-        ("prod", "prod_staging_twitter_ads"): ("staging", "twitter_ads"),
-        ("prod", "prod_staging_usage"): ("staging", "usage"),
-        ("prod", "prod_staging_zendesk"): ("staging", "zendesk"),
-        ("prod", "prod_mart_algolia"): ("mart", "algolia"),
-        ("prod", "prod_analytics"): ("mart", "algolia"),
-        ("prod", "prod_analytics_daily_aggregations_external"): ("mart", "algolia"),
-        ("prod", "prod_analytics_intermediate_query_categorization_metadata_logs_external"): ("mart", "algolia"),
-        ("prod", "prod_analytics_intermediate_search_aggregates_conversions_stats_external"): ("mart", "algolia"),
-        ("prod", "prod_analytics_intermediate_search_aggregates_logs_stats_external"): ("mart", "algolia"),
-        ("prod", "prod_analytics_intermediate_search_aggregates_searches_stats_external"): ("mart", "algolia"),
-        ("prod", "prod_analytics_intermediate_search_slg_search_aggregate_external"): ("mart", "algolia"),
-        ("prod", "prod_mart_customer_success"): ("mart", "customer_success"),
-        ("prod", "prod_mart_customer_support"): ("mart", "customer_support"),
-        ("prod", "prod_mart_finance"): ("mart", "finance"),
-        ("prod", "prod_mart_growth"): ("mart", "growth"),
-        ("prod", "prod_mart_marketing"): ("mart", "marketing"),
-        ("prod", "prod_mart_professional_services"): ("mart", "professional_services"),
-        ("prod", "prod_mart_sales"): ("mart", "sales"),
-        ("prod", "prod_reverse_etl_amplitude"): ("reverse_etl", "amplitude"),
-        ("prod", "prod_reverse_etl_endgame"): ("reverse_etl", "endgame"),
-        ("prod", "prod_reverse_etl_gainsight"): ("reverse_etl", "gainsight"),
-        ("prod", "prod_reverse_etl_headsup"): ("reverse_etl", "headsup"),
-        ("prod", "prod_reverse_etl_marketo"): ("reverse_etl", "marketo"),
-        ("prod", "prod_reverse_etl_salesforce"): ("reverse_etl", "salesforce"),
-        ("prod", "prod_reverse_etl_zendesk"): ("reverse_etl", "zendesk"),
-    }
+    return {(db, sch): (cat, new_sch) for db, sch, cat, new_sch in HARDCODED_SCHEMA_MAPPINGS}
 
 # Load schema mappings at module level
 SCHEMA_MAP = load_schema_mappings()
 
+# Old (schema-to-schema) format: precomputed replacement prefix per (database, schema) key;
+# wildcard/None schemas keep only the catalog
+SCHEMA_PREFIX = {
+    key: value[0] if value[1] in (None, "*") else f"{value[0]}.{value[1]}"
+    for key, value in SCHEMA_MAP.items()
+    if isinstance(key, tuple)
+}
+
 # ---------- 2) Load Function mappings from CSV ----------
 def load_function_mappings(csv_path="hex_yamls/schema-dialects/Redshift to Databricks Migration Mapping - Reddshift to Databricks Function Mapping.csv"):
     """Load function mappings from CSV file"""
     function_mappings = {}
     try:
         with open(csv_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            
             # Skip the first line (description) and find the header
             header_found = False
-            for i, line in enumerate(lines):
+            for line in f:
                 if 'SNO,Redshift Function,Purpose,Databricks Equivalent' in line:
                     header_found = True
-                    # Process rows starting from this header
-                    reader = csv.DictReader(lines[i:])
+                    # Process rows starting from this header, streaming the rest of the file
+                    reader = csv.reader(chain([line], f))
+                    headers = next(reader)
                     break
             
             if not header_found:
                 print("⚠️  Could not find proper header in function mapping CSV")
                 return {}
-                
+            
+            i_sno = headers.index('SNO')
+            i_func = headers.index('Redshift Function')
+            i_equiv = headers.index('Databricks Equivalent')
             for row in reader:
                 # Skip empty rows or rows without proper SNO
-                sno = row.get('SNO', '').strip()
+                sno = row[i_sno].strip() if len(row) > i_sno else ''
                 if not sno or not sno.isdigit():
                     continue
                     
-                redshift_func = row.get('Redshift Function', '').strip()
-                databricks_equiv = row.get('Databricks Equivalent', '').strip()
+                redshift_func = row[i_func].strip() if len(row) > i_func else ''
+                databricks_equiv = row[i_equiv].strip() if len(row) > i_equiv else ''
                 
                 if redshift_func and databricks_equiv and redshift_func != 'Redshift Function':
                     # Clean up the function names - remove quotes and extra spaces
@@ -333,6 +369,9 @@ def load_function_mappings(csv_path="hex_yamls/schema-dialects/Redshift to Datab
 # Load function mappings at module level
 FUNCTION_MAPPINGS = load_function_mappings()
 
+SCHEMA_QUALIFIED_PATTERN = re.compile(r'\b([A-Za-z0-9_]+)\.([A-Za-z0-9_]+)(\.[A-Za-z0-9_`"]+)', re.IGNORECASE)
+PROD_UNDERSCORE_PATTERN = re.compile(r'\b(prod)_([A-Za-z0-9_]+)(\.[A-Za-z0-9_`"]+)', re.IGNORECASE)
+
 # Helper to rewrite fully qualified refs like prod.schema.table to catalog.schema.table
 def rewrite_schema_qualification(sql: str) -> str:
     """
@@ -352,78 +391,127 @@ def rewrite_schema_qualification(sql: str) -> str:
         db = match.group(1)
         sch = match.group(2)
         rest = match.group(3)  # includes leading dot + table/view/etc
-        key = (db.lower(), sch.lower())
-        if key in SCHEMA_MAP:
-            cat, new_sch = SCHEMA_MAP[key]
-            if new_sch in (None, "*"):
-                # keep object name only if schema is wildcard/None; otherwise use provided schema
-                return f"{cat}{rest}"
-            return f"{cat}.{new_sch}{rest}"
-        return match.group(0)
+        prefix = SCHEMA_PREFIX.get((db.lower(), sch.lower()))
+        return f"{prefix}{rest}" if prefix is not None else match.group(0)
     
     def repl_underscore(match):
-        db = match.group(1)
+        db = match.group(1).lower()
         sch = match.group(2)
         rest = match.group(3)  # includes leading dot + table/view/etc
-        key = (db.lower(), f"{db.lower()}_{sch.lower()}")
-        if key in SCHEMA_MAP:
-            cat, new_sch = SCHEMA_MAP[key]
-            if new_sch in (None, "*"):
-                # keep object name only if schema is wildcard/None; otherwise use provided schema
-                return f"{cat}{rest}"
-            return f"{cat}.{new_sch}{rest}"
-        return match.group(0)
+        prefix = SCHEMA_PREFIX.get((db, f"{db}_{sch.lower()}"))
+        return f"{prefix}{rest}" if prefix is not None else match.group(0)
     
     # Match prod.schema.object  (object can include dots for dbt models or views)
-    pattern = re.compile(r'\b([A-Za-z0-9_]+)\.([A-Za-z0-9_]+)(\.[A-Za-z0-9_`"]+)', re.IGNORECASE)
-    out = pattern.sub(repl, sql)
+    out = SCHEMA_QUALIFIED_PATTERN.sub(repl, sql)
     
     # Match prod_schema.object  (underscore format)
-    pattern_underscore = re.compile(r'\b(prod)_([A-Za-z0-9_]+)(\.[A-Za-z0-9_`"]+)', re.IGNORECASE)
-    out = pattern_underscore.sub(repl_underscore, out)
+    out = PROD_UNDERSCORE_PATTERN.sub(repl_underscore, out)
+    return out
+
+# ---------- Table-to-table rewrite index ----------
+# rewrite_table_references applies mappings longest key first. Rather than regex-scanning
+# the SQL once per mapping, it only tries the keys whose words all occur in the SQL:
+# a key can only match where each of its word runs appears as a whole word.
+WORD_PATTERN = re.compile(r"\w+")
+# Non-ASCII characters that re.IGNORECASE matches against ASCII letters
+IGNORECASE_ASCII_EQUIVALENTS = str.maketrans({"\u0130": "i", "\u0131": "i", "\u017f": "s", "\u212a": "k"})
+
+def fold_ignorecase(text: str) -> str:
+    """Lowercased text where anything re.IGNORECASE matches to an ASCII literal reads as that literal"""
+    return text.translate(IGNORECASE_ASCII_EQUIVALENTS).lower()
+
+def build_table_mapping_index(schema_map):
+    """
+    Returns (mappings, keys_by_word, key_words, always) for table-to-table mappings:
+    the (key, target) pairs in rewrite order, a map from a word of each key to the
+    positions of the keys containing it, each key's set of words, and the positions
+    of keys without any word characters (always tried).
+    """
+    mappings = sorted(schema_map.items(), key=lambda x: -len(x[0]))
+    keys_by_word = {}
+    key_words = []
+    always = []
+    for rank, (redshift_table, _) in enumerate(mappings):
+        words = frozenset(WORD_PATTERN.findall(redshift_table.lower()))
+        key_words.append(words)
+        if words:
+            keys_by_word.setdefault(min(words), []).append(rank)
+        else:
+            always.append(rank)
+    return mappings, keys_by_word, key_words, always
+
+if SCHEMA_MAP and isinstance(next(iter(SCHEMA_MAP.keys())), str):
+    TABLE_MAPPINGS, TABLE_KEYS_BY_WORD, TABLE_KEY_WORDS, TABLE_KEYS_ALWAYS = build_table_mapping_index(SCHEMA_MAP)
+else:
+    TABLE_MAPPINGS, TABLE_KEYS_BY_WORD, TABLE_KEY_WORDS, TABLE_KEYS_ALWAYS = [], {}, [], []
+
+def _table_candidates(sql: str):
+    """Positions in TABLE_MAPPINGS of every key that could match somewhere in sql"""
+    words = set(WORD_PATTERN.findall(fold_ignorecase(sql)))
+    candidates = list(TABLE_KEYS_ALWAYS)
+    for word in words:
+        for rank in TABLE_KEYS_BY_WORD.get(word, ()):
+            if TABLE_KEY_WORDS[rank] <= words:
+                candidates.append(rank)
+    return candidates
+
+@lru_cache(maxsize=4096)
+def _table_reference_patterns(redshift_table: str):
+    """Compiled patterns rewrite_table_references tries, in order, for one mapping"""
+    # Handle different quoting and reference patterns
+    patterns_to_try = []
+    
+    # Pattern 1: Unquoted table name with word boundaries
+    patterns_to_try.append(rf'\b{re.escape(redshift_table)}\b')
+    
+    # Pattern 2: Fully quoted table name
+    patterns_to_try.append(rf'"{re.escape(redshift_table)}"')
+    
+    # Pattern 3: Handle schema.table patterns where redshift_table might be schema.table
+    if '.' in redshift_table:
+        parts = redshift_table.split('.')
+        # "schema"."table" format
+        if len(parts) == 2:
+            quoted_pattern = rf'"{re.escape(parts[0])}"\s*\.\s*"{re.escape(parts[1])}"'
+            patterns_to_try.append(quoted_pattern)
+        # catalog.schema.table format  
+        elif len(parts) == 3:
+            quoted_pattern = rf'"{re.escape(parts[0])}"\s*\.\s*"{re.escape(parts[1])}"\s*\.\s*"{re.escape(parts[2])}"'
+            patterns_to_try.append(quoted_pattern)
+    
+    return [re.compile(pattern, re.IGNORECASE) for pattern in patterns_to_try]
 
 def rewrite_table_references(sql: str) -> str:
     """
     Rewrite table references using table-to-table mappings.
     Handles various quoting patterns and ensures proper replacement.
     """
-    out = sql
+    # Visit candidate mappings in rewrite order (longest key first, to avoid partial matches)
+    pending = _table_candidates(sql)
+    if not pending:
+        return sql
     
-    # Sort mappings by length (descending) to avoid partial matches
-    sorted_mappings = sorted(SCHEMA_MAP.items(), key=lambda x: -len(x[0]))
+    out = sql
+    heapq.heapify(pending)
+    queued = set(pending)
     
-    for redshift_table, databricks_table in sorted_mappings:
-        # Handle different quoting and reference patterns
-        patterns_to_try = []
-        
-        # Pattern 1: Unquoted table name with word boundaries
-        patterns_to_try.append(rf'\b{re.escape(redshift_table)}\b')
-        
-        # Pattern 2: Fully quoted table name
-        patterns_to_try.append(rf'"{re.escape(redshift_table)}"')
-        
-        # Pattern 3: Handle schema.table patterns where redshift_table might be schema.table
-        if '.' in redshift_table:
-            parts = redshift_table.split('.')
-            # "schema"."table" format
-            if len(parts) == 2:
-                quoted_pattern = rf'"{re.escape(parts[0])}"\s*\.\s*"{re.escape(parts[1])}"'
-                patterns_to_try.append(quoted_pattern)
-            # catalog.schema.table format  
-            elif len(parts) == 3:
-                quoted_pattern = rf'"{re.escape(parts[0])}"\s*\.\s*"{re.escape(parts[1])}"\s*\.\s*"{re.escape(parts[2])}"'
-                patterns_to_try.append(quoted_pattern)
+    while pending:
+        rank = heapq.heappop(pending)
+        redshift_table, databricks_table = TABLE_MAPPINGS[rank]
         
         # Try each pattern
-        for pattern in patterns_to_try:
-            new_sql = re.sub(pattern, databricks_table, out, flags=re.IGNORECASE)
+        for pattern in _table_reference_patterns(redshift_table):
+            new_sql = pattern.sub(databricks_table, out)
             if new_sql != out:
                 out = new_sql
+                # The replacement can bring new words in; queue any later key they complete
+                for candidate in _table_candidates(out):
+                    if candidate > rank and candidate not in queued:
+                        queued.add(candidate)
+                        heapq.heappush(pending, candidate)
                 break  # Move to next mapping once we find a match
     
     return out
-    
-    return out
 
 
 # ---------- 3) Function & syntax rewrites (enhanced with CSV mappings) ----------
@@ -454,259 +542,291 @@ SQL_SIMPLE_REWRITES = [
     # EXTRACT to dedicated functions (handled by complex replacer below)
 ]
 
-def apply_csv_function_mappings(sql: str) -> str:
-    """Apply function mappings from CSV file"""
-    out = sql
-    
-    # Apply loaded function mappings from CSV
-    for redshift_func, databricks_equiv in FUNCTION_MAPPINGS.items():
+# Literal-replacement rules never overlap each other, so they run as one alternation in a
+# single scan, dispatching on the named group that matched. Rules whose replacement uses
+# back-references (the CAST rule) stay separate passes; they only wrap tokens the
+# alternation rewrites, so running them afterwards gives the same result as in-order.
+_LITERAL_REWRITES = [(pat, repl) for pat, repl in SQL_SIMPLE_REWRITES if not re.search(r'\\(\d|g<)', repl)]
+# Every rule starts with a literal character (after an optional \b); a lookahead on that set
+# lets the scan skip positions where no rule can begin instead of trying each alternative
+_REWRITE_FIRST_CHARS = "".join(sorted({pat.removeprefix(r'\b')[0] for pat, _ in _LITERAL_REWRITES}))
+SIMPLE_REWRITE_PATTERN = re.compile(
+    f"(?=[{re.escape(_REWRITE_FIRST_CHARS)}])(?:"
+    + "|".join(f"(?P<r{i}>{pat})" for i, (pat, _) in enumerate(_LITERAL_REWRITES))
+    + ")",
+    re.IGNORECASE,
+)
+SIMPLE_REWRITE_REPLACEMENTS = {f"r{i}": repl for i, (_, repl) in enumerate(_LITERAL_REWRITES)}
+SQL_BACKREF_REWRITES = [
+    (re.compile(pat, re.IGNORECASE), repl)
+    for pat, repl in SQL_SIMPLE_REWRITES
+    if (pat, repl) not in _LITERAL_REWRITES
+]
+VARCHAR_PATTERN = re.compile(r'\bVARCHAR\b', re.IGNORECASE)
+
+def build_csv_function_actions(function_mappings):
+    """(pattern, replacement) rewrites implied by the loaded CSV function mappings"""
+    actions = []
+    for redshift_func, databricks_equiv in function_mappings.items():
         if redshift_func and databricks_equiv:
             # Handle some special cases based on the CSV content
             if 'VARCHAR' in redshift_func:
-                # Handle VARCHAR -> STRING mapping
-                out = re.sub(r'\bVARCHAR\b', 'STRING', out, flags=re.IGNORECASE)
-            elif 'CURRENT_DATE' in redshift_func:
-                # Already handled in simple rewrites
-                continue
-            elif 'CURRENT_TIMESTAMP' in redshift_func:
-                # Already handled in simple rewrites  
-                continue
-            else:
-                # For more complex function patterns, we'll handle them in the complex function rewriter
-                pass
-    
+                # Handle VARCHAR -> STRING mapping (idempotent, so one pass covers every VARCHAR row)
+                if (VARCHAR_PATTERN, 'STRING') not in actions:
+                    actions.append((VARCHAR_PATTERN, 'STRING'))
+            # CURRENT_DATE/CURRENT_TIMESTAMP are already handled in simple rewrites; more complex
+            # function patterns are handled in the complex function rewriter
+    return actions
+
+CSV_FUNCTION_ACTIONS = build_csv_function_actions(FUNCTION_MAPPINGS)
+
+def apply_csv_function_mappings(sql: str) -> str:
+    """Apply function mappings from CSV file"""
+    out = sql
+    for pattern, replacement in CSV_FUNCTION_ACTIONS:
+        out = pattern.sub(replacement, out)
     return out
 
 QUALIFY_PATTERN = re.compile(r'QUALIFY\b', re.IGNORECASE)
+DATEADD_PATTERN = re.compile(r'\bDATEADD\s*\(', re.IGNORECASE)
+# Only parens and commas matter when splitting call arguments
+ARG_DELIMITER_PATTERN = re.compile(r'[(),]')
+
+def find_closing_paren(text: str, open_pos: int) -> int:
+    """
+    Index just past the ')' matching the '(' at open_pos, or -1 if it is never closed.
+    Jumps between parens with str.find instead of stepping through every character.
+    """
+    depth = 1
+    next_open = text.find('(', open_pos + 1)
+    next_close = text.find(')', open_pos + 1)
+    while next_close != -1:
+        if next_open != -1 and next_open < next_close:
+            depth += 1
+            next_open = text.find('(', next_open + 1)
+        else:
+            depth -= 1
+            if depth == 0:
+                return next_close + 1
+            next_close = text.find(')', next_close + 1)
+    return -1
+
+def split_top_level_commas(text: str, limit=None) -> list:
+    """
+    Stripped pieces of text split on the commas outside parentheses, making at most
+    limit splits. Jumps between delimiters with ARG_DELIMITER_PATTERN.
+    """
+    args = []
+    arg_start = 0
+    paren_depth = 0
+    for delim in ARG_DELIMITER_PATTERN.finditer(text):
+        char = delim.group()
+        if char == '(':
+            paren_depth += 1
+        elif char == ')':
+            paren_depth -= 1
+        elif paren_depth == 0:
+            args.append(text[arg_start:delim.start()].strip())
+            arg_start = delim.end()
+            if len(args) == limit:
+                break
+    last_arg = text[arg_start:]
+    if last_arg:
+        args.append(last_arg.strip())
+    return args
+
+def rewrite_function_calls(text: str, opener, handler, limit=None, trailer=None) -> str:
+    """
+    Replaces each call found by opener (a compiled pattern ending at the call's '(') with
+    handler(args), args being its top-level arguments (split at most limit times). Calls
+    are kept as-is when handler returns None or their parentheses never close. A clause
+    matching trailer (also ending at a '(') right after the call is replaced along with it.
+    """
+    result = []
+    i = 0
+    while i < len(text):
+        # Search in place from i (no slice copy of the remaining text)
+        match = opener.search(text, i)
+        if not match:
+            result.append(text[i:])
+            break
+        
+        # Add text before match
+        result.append(text[i:match.start()])
+        
+        # Find the complete function call
+        start_pos = match.start()
+        paren_pos = match.end() - 1  # Position of opening parenthesis
+        
+        # Find the matching closing parenthesis
+        j = find_closing_paren(text, paren_pos)
+        
+        if j != -1:
+            # Found complete function call; split its arguments, respecting nested parentheses
+            replacement = handler(split_top_level_commas(text[paren_pos + 1:j - 1], limit))
+            if replacement is not None and trailer:
+                # Swallow a trailing clause such as WITHIN GROUP (...) when it is balanced
+                trailer_match = trailer.match(text, j)
+                if trailer_match:
+                    trailer_end = find_closing_paren(text, trailer_match.end() - 1)
+                    if trailer_end != -1:
+                        j = trailer_end
+            if replacement is None:
+                result.append(text[start_pos:j])  # Keep original if can't parse
+            else:
+                result.append(replacement)
+            i = j
+        else:
+            # Malformed function call, keep original
+            result.append(text[start_pos:match.end()])
+            i = match.end()
+    
+    return ''.join(result)
+
+DATE_TRUNC_PATTERN = re.compile(r"\bDATE_TRUNC\s*\(\s*'(\w+)'\s*,\s*(.*?)\)", re.IGNORECASE)
+DATEDIFF_PATTERN = re.compile(r'\bDATEDIFF\s*\(', re.IGNORECASE)
+DATEADD_WEEK_PATTERN = re.compile(r"\bDATEADD\s*\(\s*week\s*,\s*([^,]+)\s*,\s*([^)]+)\)", re.IGNORECASE)
+NEGATIVE_INT_PATTERN = re.compile(r'-\s*\d+')
+# DATEADD units dateadd_call_repl rewrites: unit -> days per unit for date_add/date_sub, None for add_months
+DATEADD_UNIT_DAYS = {'day': 1, 'days': 1, 'week': 7, 'weeks': 7, 'month': None, 'months': None}
+WHITESPACE_PATTERN = re.compile(r'\s+')
+TO_CHAR_PATTERN = re.compile(r'\bTO_CHAR\s*\(', re.IGNORECASE)
+TO_DATE_PATTERN = re.compile(r'\bTO_DATE\s*\(', re.IGNORECASE)
+# TO_CHAR/TO_DATE format argument: one single-quoted literal
+FORMAT_LITERAL_PATTERN = re.compile(r"'([^']+)'")
+# Redshift TO_CHAR format tokens -> Spark date_format tokens (simple token map common in your examples)
+TO_CHAR_FORMAT_TOKENS = {
+    'YYYY': 'yyyy',
+    'YY': 'yy',
+    'MM': 'MM',
+    'MON': 'MMM',
+    'DD': 'dd',
+    'HH24': 'HH',
+    'HH12': 'hh',
+    'MI': 'mm',
+    'SS': 'ss',
+}
+# Longest tokens first so YYYY wins over YY and HH24 is not split
+TO_CHAR_FORMAT_TOKEN_PATTERN = re.compile('|'.join(sorted(TO_CHAR_FORMAT_TOKENS, key=len, reverse=True)))
+JSON_PATH_TEXT_PATTERN = re.compile(r"\bJSON_EXTRACT_PATH_TEXT\s*\(\s*([^,]+)\s*,\s*('[^']+'|\"[^\"]+\")\s*\)", re.IGNORECASE)
+JSON_ARRAY_ELEMENT_TEXT_PATTERN = re.compile(r"\bJSON_EXTRACT_ARRAY_ELEMENT_TEXT\s*\(\s*([^,]+)\s*,\s*([^)]+)\)", re.IGNORECASE)
+IS_VALID_JSON_ARRAY_PATTERN = re.compile(r"\bIS_VALID_JSON_ARRAY\s*\(\s*([^)]+)\)", re.IGNORECASE)
+IS_VALID_JSON_PATTERN = re.compile(r"\bIS_VALID_JSON\s*\(\s*([^)]+)\)", re.IGNORECASE)
+JSON_PARSE_PATTERN = re.compile(r"\bJSON_PARSE\s*\(\s*([^)]+)\)", re.IGNORECASE)
+LISTAGG_PATTERN = re.compile(r'\bLISTAGG\s*\(', re.IGNORECASE)
+# WITHIN GROUP (ORDER BY ...) following a LISTAGG call; dropped by the rewrite
+LISTAGG_WITHIN_GROUP_PATTERN = re.compile(r'\s+WITHIN\s+GROUP\s*\(', re.IGNORECASE)
+CONVERT_PATTERN = re.compile(r"\bCONVERT\s*\(\s*(\w+)\s*,\s*(.+?)\s*\)", re.IGNORECASE)
+DATEPART_PATTERN = re.compile(r"\bDATEPART\s*\(\s*'(\w+)'\s*,\s*(.+?)\)", re.IGNORECASE)
+EXTRACT_PATTERN = re.compile(r"\bEXTRACT\s*\(\s*(\w+)\s+FROM\s+(.+?)\)", re.IGNORECASE)
+
+def dateadd_call_repl(args):
+    """DATEADD(unit, n, expr) arguments -> date_add/date_sub/add_months, or DATEADD for other units."""
+    if len(args) < 3:
+        return None
+    part = args[0].lower()
+    n = args[1]
+    expr = args[2]
+    
+    unit_days = DATEADD_UNIT_DAYS.get(part, 0)
+    if unit_days:
+        # Weeks are converted to days (1 week = 7 days); a negative literal becomes date_sub
+        scale = '' if unit_days == 1 else f" * {unit_days}"
+        if NEGATIVE_INT_PATTERN.fullmatch(n):
+            n_clean = WHITESPACE_PATTERN.sub('', n)[1:]  # drop leading '-'
+            return f"date_sub({expr}, {n_clean}{scale})"
+        return f"date_add({expr}, {n}{scale})"
+    if unit_days is None:
+        return f"add_months({expr}, {n})"
+    # leave others as ANSI DATEADD (Databricks supports many units)
+    return f"DATEADD({part}, {n}, {expr})"
+
+def datediff_call_repl(args):
+    """DATEDIFF(unit, d1, d2) arguments -> datediff(d2, d1) for days, DATEDIFF for other units."""
+    if len(args) < 3:
+        return None
+    part = args[0].lower()
+    d1 = args[1]
+    d2 = args[2]
+    if part in ('day', 'days'):
+        return f"datediff({d2}, {d1})"
+    return f"DATEDIFF({part}, {d1}, {d2})"
+
+def to_char_call_repl(args):
+    """TO_CHAR(expr, 'fmt') arguments -> date_format(expr, 'fmt') with Spark format tokens."""
+    if len(args) < 2 or not args[0]:
+        return None
+    fmt_match = FORMAT_LITERAL_PATTERN.fullmatch(args[1])
+    if not fmt_match:
+        return None
+    return f"date_format({args[0]}, '{to_char_spark_format(fmt_match.group(1))}')"
+
+@lru_cache(maxsize=1024)
+def to_char_spark_format(fmt: str) -> str:
+    """
+    Converts a TO_CHAR format string's tokens in one left-to-right pass.
+    Cached because the same handful of formats recur across cells.
+    """
+    return TO_CHAR_FORMAT_TOKEN_PATTERN.sub(lambda m: TO_CHAR_FORMAT_TOKENS[m.group()], fmt)
+
+def to_date_call_repl(args):
+    """TO_DATE(expr, 'fmt') arguments -> to_date(expr, 'fmt') with Spark format tokens."""
+    if len(args) < 2 or not args[0]:
+        return None
+    fmt_match = FORMAT_LITERAL_PATTERN.fullmatch(args[1])
+    if not fmt_match:
+        return None
+    expr = args[0]
+    fmt_new = fmt_match.group(1).replace('YYYY','yyyy').replace('DD','dd')
+    return f"to_date({expr}, '{fmt_new}')"
+
+def listagg_call_repl(args):
+    """LISTAGG(col, delim) arguments -> concat_ws(delim, collect_list(col)), or STRING_AGG(col)."""
+    if not args or not args[0]:
+        return None
+    if len(args) >= 2:
+        col, delim = args
+        return f"concat_ws({delim}, collect_list({col}))"
+    return f"STRING_AGG({args[0]})"
 
 # Complex function translations requiring argument reordering or pattern interpretation
 def rewrite_complex_functions(sql: str) -> str:
     out = sql
+    # Each pass only runs when its function name occurs in the (case-folded) SQL;
+    # the folded copy is refreshed after every pass that runs
+    folded = fold_ignorecase(out)
 
     # DATE_TRUNC('unit', expr) -> date_trunc('UNIT', expr) (upper-case unit)
     def dt_repl(m):
         unit = m.group(1)
         expr = m.group(2)
         return f"date_trunc('{unit.upper()}', {expr})"
-    out = re.sub(r"\bDATE_TRUNC\s*\(\s*'(\w+)'\s*,\s*(.*?)\)", dt_repl, out, flags=re.IGNORECASE)
+    if 'date_trunc' in folded:
+        out = DATE_TRUNC_PATTERN.sub(dt_repl, out)
+        folded = fold_ignorecase(out)
 
     # DATEADD(day, n, date_col) -> date_add(date_col, n) ; if n negative literal -> date_sub(date_col, abs(n))
-    def dateadd_repl(m):
-        part = m.group(1).lower()
-        n = m.group(2).strip()
-        expr = m.group(3).strip()
-        if part == 'day' or part == 'days':
-            # try to detect simple negative literal
-            if re.fullmatch(r'-\s*\d+', n):
-                n_clean = re.sub(r'\s+', '', n)[1:]  # drop leading '-'
-                return f"date_sub({expr}, {n_clean})"
-            else:
-                return f"date_add({expr}, {n})"
-        elif part == 'month' or part == 'months':
-            return f"add_months({expr}, {n})"
-        else:
-            # leave others as ANSI DATEADD (Databricks supports many units)
-            return f"DATEADD({part}, {n}, {expr})"
-    
-    # Improved regex to handle nested parentheses in function calls
-    def replace_dateadd(text):
-        pattern = r'\bDATEADD\s*\('
-        result = []
-        i = 0
-        while i < len(text):
-            match = re.search(pattern, text[i:], re.IGNORECASE)
-            if not match:
-                result.append(text[i:])
-                break
-            
-            # Add text before match
-            result.append(text[i:i + match.start()])
-            
-            # Find the complete DATEADD function call
-            start_pos = i + match.start()
-            paren_pos = i + match.end() - 1  # Position of opening parenthesis
-            
-            # Count parentheses to find the matching closing one
-            paren_count = 1
-            j = paren_pos + 1
-            while j < len(text) and paren_count > 0:
-                if text[j] == '(':
-                    paren_count += 1
-                elif text[j] == ')':
-                    paren_count -= 1
-                j += 1
-            
-            if paren_count == 0:
-                # Found complete function call
-                full_call = text[start_pos:j]
-                # Extract arguments more carefully
-                inner_args = text[paren_pos + 1:j - 1]
-                
-                # Split by commas, but respect nested parentheses
-                args = []
-                current_arg = ""
-                paren_depth = 0
-                for char in inner_args:
-                    if char == '(' :
-                        paren_depth += 1
-                        current_arg += char
-                    elif char == ')':
-                        paren_depth -= 1
-                        current_arg += char
-                    elif char == ',' and paren_depth == 0:
-                        args.append(current_arg.strip())
-                        current_arg = ""
-                    else:
-                        current_arg += char
-                
-                if current_arg:
-                    args.append(current_arg.strip())
-                
-                if len(args) >= 3:
-                    part = args[0].lower()
-                    n = args[1].strip()
-                    expr = args[2].strip()
-                    
-                    if part == 'day' or part == 'days':
-                        if re.fullmatch(r'-\s*\d+', n):
-                            n_clean = re.sub(r'\s+', '', n)[1:]
-                            replacement = f"date_sub({expr}, {n_clean})"
-                        else:
-                            replacement = f"date_add({expr}, {n})"
-                    elif part == 'week' or part == 'weeks':
-                        # Convert weeks to days (1 week = 7 days)
-                        if re.fullmatch(r'-\s*\d+', n):
-                            n_clean = re.sub(r'\s+', '', n)[1:]
-                            replacement = f"date_sub({expr}, {n_clean} * 7)"
-                        else:
-                            replacement = f"date_add({expr}, {n} * 7)"
-                    elif part == 'month' or part == 'months':
-                        replacement = f"add_months({expr}, {n})"
-                    else:
-                        replacement = f"DATEADD({part}, {n}, {expr})"
-                    
-                    result.append(replacement)
-                else:
-                    result.append(full_call)  # Keep original if can't parse
-                
-                i = j
-            else:
-                # Malformed function call, keep original
-                result.append(text[start_pos:start_pos + match.end() - match.start()])
-                i = start_pos + match.end() - match.start()
-        
-        return ''.join(result)
-    
-    out = replace_dateadd(out)
+    # Calls are parsed with paren balancing so nested function calls in the arguments survive
+    if 'dateadd' in folded:
+        out = rewrite_function_calls(out, DATEADD_PATTERN, dateadd_call_repl)
+        folded = fold_ignorecase(out)
 
     # DATEDIFF(day, d1, d2) -> datediff(d2, d1) ; for other units, keep as-is (Databricks ANSI supports)
     # Use similar approach as DATEADD to handle nested parentheses
-    def replace_datediff(text):
-        pattern = r'\bDATEDIFF\s*\('
-        result = []
-        i = 0
-        while i < len(text):
-            match = re.search(pattern, text[i:], re.IGNORECASE)
-            if not match:
-                result.append(text[i:])
-                break
-            
-            # Add text before match
-            result.append(text[i:i + match.start()])
-            
-            # Find the complete DATEDIFF function call
-            start_pos = i + match.start()
-            paren_pos = i + match.end() - 1  # Position of opening parenthesis
-            
-            # Count parentheses to find the matching closing one
-            paren_count = 1
-            j = paren_pos + 1
-            while j < len(text) and paren_count > 0:
-                if text[j] == '(':
-                    paren_count += 1
-                elif text[j] == ')':
-                    paren_count -= 1
-                j += 1
-            
-            if paren_count == 0:
-                # Found complete function call
-                full_call = text[start_pos:j]
-                # Extract arguments more carefully
-                inner_args = text[paren_pos + 1:j - 1]
-                
-                # Split by commas, but respect nested parentheses
-                args = []
-                current_arg = ""
-                paren_depth = 0
-                for char in inner_args:
-                    if char == '(':
-                        paren_depth += 1
-                        current_arg += char
-                    elif char == ')':
-                        paren_depth -= 1
-                        current_arg += char
-                    elif char == ',' and paren_depth == 0:
-                        args.append(current_arg.strip())
-                        current_arg = ""
-                    else:
-                        current_arg += char
-                
-                if current_arg:
-                    args.append(current_arg.strip())
-                
-                if len(args) >= 3:
-                    part = args[0].lower()
-                    d1 = args[1].strip()
-                    d2 = args[2].strip()
-                    
-                    if part in ('day', 'days'):
-                        replacement = f"datediff({d2}, {d1})"
-                    else:
-                        replacement = f"DATEDIFF({part}, {d1}, {d2})"
-                    
-                    result.append(replacement)
-                else:
-                    result.append(full_call)  # Keep original if can't parse
-                
-                i = j
-            else:
-                # Malformed function call, keep original
-                result.append(text[start_pos:start_pos + match.end() - match.start()])
-                i = start_pos + match.end() - match.start()
-        
-        return ''.join(result)
-    
-    out = replace_datediff(out)
+    if 'datediff' in folded:
+        out = rewrite_function_calls(out, DATEDIFF_PATTERN, datediff_call_repl)
+        folded = fold_ignorecase(out)
 
     # TO_CHAR(ts, 'fmt') -> date_format(ts, 'fmt') with format token normalization
-    def tochar_repl(m):
-        expr = m.group(1).strip()
-        fmt = m.group(2)
-        # Simple token map common in your examples
-        fmt_map = [
-            ('YYYY', 'yyyy'),
-            ('YY', 'yy'),
-            ('MM', 'MM'),
-            ('MON', 'MMM'),
-            ('DD', 'dd'),
-            ('HH24', 'HH'),
-            ('HH12', 'hh'),
-            ('MI', 'mm'),
-            ('SS', 'ss')
-        ]
-        fmt_new = fmt
-        for k,v in fmt_map:
-            fmt_new = fmt_new.replace(k, v)
-        return f"date_format({expr}, '{fmt_new}')"
-    out = re.sub(r"\bTO_CHAR\s*\(\s*(.+?)\s*,\s*'([^']+)'\s*\)", tochar_repl, out, flags=re.IGNORECASE)
+    # The format literal may contain commas, so only the first top-level comma splits the call
+    if 'to_char' in folded:
+        out = rewrite_function_calls(out, TO_CHAR_PATTERN, to_char_call_repl, limit=1)
+        folded = fold_ignorecase(out)
 
     # TO_DATE('2023-01-01','YYYY-MM-DD') -> to_date('2023-01-01','yyyy-MM-dd')
-    def todate_repl(m):
-        expr = m.group(1).strip()
-        fmt = m.group(2)
-        fmt_new = fmt.replace('YYYY','yyyy').replace('DD','dd')
-        return f"to_date({expr}, '{fmt_new}')"
-    out = re.sub(r"\bTO_DATE\s*\(\s*(.+?)\s*,\s*'([^']+)'\s*\)", todate_repl, out, flags=re.IGNORECASE)
+    if 'to_date' in folded:
+        out = rewrite_function_calls(out, TO_DATE_PATTERN, to_date_call_repl, limit=1)
+        folded = fold_ignorecase(out)
 
     # JSON_EXTRACT_PATH_TEXT(json_col, 'a.b') -> get_json_object(json_col, '$.a.b')
     def jpath_repl(m):
@@ -716,37 +836,37 @@ def rewrite_complex_functions(sql: str) -> str:
         if not path.startswith('$.'):
             path = '$.' + path
         return f"get_json_object({col}, '{path}')"
-    out = re.sub(r"\bJSON_EXTRACT_PATH_TEXT\s*\(\s*([^,]+)\s*,\s*('[^']+'|\"[^\"]+\")\s*\)", jpath_repl, out, flags=re.IGNORECASE)
+    if 'json_extract_path_text' in folded:
+        out = JSON_PATH_TEXT_PATTERN.sub(jpath_repl, out)
+        folded = fold_ignorecase(out)
 
     # JSON_EXTRACT_ARRAY_ELEMENT_TEXT(json_col, idx) -> get_json_object(json_col, '$[idx]')
     def jarr_repl(m):
         col = m.group(1).strip()
         idx = m.group(2).strip()
         return f"get_json_object({col}, '$[{idx}]')"
-    out = re.sub(r"\bJSON_EXTRACT_ARRAY_ELEMENT_TEXT\s*\(\s*([^,]+)\s*,\s*([^)]+)\)", jarr_repl, out, flags=re.IGNORECASE)
+    if 'json_extract_array_element_text' in folded:
+        out = JSON_ARRAY_ELEMENT_TEXT_PATTERN.sub(jarr_repl, out)
+        folded = fold_ignorecase(out)
 
     # IS_VALID_JSON(json) -> try(from_json(json,'map<string,string>')) IS NOT NULL
-    out = re.sub(r"\bIS_VALID_JSON_ARRAY\s*\(\s*([^)]+)\)", r"try(from_json(\1, 'array<string>')) IS NOT NULL", out, flags=re.IGNORECASE)
-    out = re.sub(r"\bIS_VALID_JSON\s*\(\s*([^)]+)\)", r"try(from_json(\1, 'map<string,string>')) IS NOT NULL", out, flags=re.IGNORECASE)
+    if 'is_valid_json' in folded:
+        out = IS_VALID_JSON_ARRAY_PATTERN.sub(r"try(from_json(\1, 'array<string>')) IS NOT NULL", out)
+        out = IS_VALID_JSON_PATTERN.sub(r"try(from_json(\1, 'map<string,string>')) IS NOT NULL", out)
+        folded = fold_ignorecase(out)
 
     # JSON_PARSE(json) -> from_json(json, <schema>) with TODO marker if schema missing
-    out = re.sub(r"\bJSON_PARSE\s*\(\s*([^)]+)\)", r"/* TODO: provide schema */ from_json(\1, '<provide_schema_here>')", out, flags=re.IGNORECASE)
-
-    # LISTAGG(col, delim) -> concat_ws(delim, collect_list(col))
-    # Handle WITHIN GROUP (ORDER BY ...) clause
-    def listagg_repl(m):
-        args = m.group(1)
-        parts = [a.strip() for a in args.split(',')]
-        if len(parts) >= 2:
-            col = parts[0]
-            delim = ','.join(parts[1:])  # delimiter expression may contain commas
-            return f"concat_ws({delim}, collect_list({col}))"
-        return f"STRING_AGG({args})"
-    
-    # First handle LISTAGG with WITHIN GROUP clause
-    out = re.sub(r"\bLISTAGG\s*\(\s*(.+?)\s*\)\s+WITHIN\s+GROUP\s*\([^)]*\)", listagg_repl, out, flags=re.IGNORECASE)
-    # Then handle simple LISTAGG without WITHIN GROUP
-    out = re.sub(r"\bLISTAGG\s*\(\s*(.+?)\s*\)", listagg_repl, out, flags=re.IGNORECASE)
+    if 'json_parse' in folded:
+        out = JSON_PARSE_PATTERN.sub(r"/* TODO: provide schema */ from_json(\1, '<provide_schema_here>')", out)
+        folded = fold_ignorecase(out)
+
+    # LISTAGG(col, delim) -> concat_ws(delim, collect_list(col)), dropping any WITHIN GROUP (ORDER BY ...)
+    # Calls are parsed with paren balancing; only the first top-level comma separates the
+    # column, since the delimiter may contain commas
+    if 'listagg' in folded:
+        out = rewrite_function_calls(out, LISTAGG_PATTERN, listagg_call_repl, limit=1,
+                                     trailer=LISTAGG_WITHIN_GROUP_PATTERN)
+        folded = fold_ignorecase(out)
 
     # CONVERT(type, expression) -> CAST(expression AS type)
     def convert_repl(m):
@@ -769,7 +889,9 @@ def rewrite_complex_functions(sql: str) -> str:
         mapped_type = type_mapping.get(type_name, type_name)
         return f"CAST({expr} AS {mapped_type})"
     
-    out = re.sub(r"\bCONVERT\s*\(\s*(\w+)\s*,\s*(.+?)\s*\)", convert_repl, out, flags=re.IGNORECASE)
+    if 'convert' in folded:
+        out = CONVERT_PATTERN.sub(convert_repl, out)
+        folded = fold_ignorecase(out)
 
     # DATEPART('field', expr) -> year(expr)/month(expr)/etc
     def datepart_repl(m):
@@ -787,7 +909,9 @@ def rewrite_complex_functions(sql: str) -> str:
         if func:
             return f"{func}({expr})"
         return m.group(0)
-    out = re.sub(r"\bDATEPART\s*\(\s*'(\w+)'\s*,\s*(.+?)\)", datepart_repl, out, flags=re.IGNORECASE)
+    if 'datepart' in folded:
+        out = DATEPART_PATTERN.sub(datepart_repl, out)
+        folded = fold_ignorecase(out)
 
     # EXTRACT(<field> FROM expr) -> corresponding function
     def extract_repl(m):
@@ -808,20 +932,85 @@ def rewrite_complex_functions(sql: str) -> str:
         if func:
             return f"{func}({expr})"
         return m.group(0)
-    out = re.sub(r"\bEXTRACT\s*\(\s*(\w+)\s+FROM\s+(.+?)\)", extract_repl, out, flags=re.IGNORECASE)
+    if 'extract' in folded:
+        out = EXTRACT_PATTERN.sub(extract_repl, out)
+        folded = fold_ignorecase(out)
 
     # Handle DATEADD with 'week' unit -> date_add with 7 * n days
     def dateadd_week_repl(m):
         n = m.group(1).strip()
         expr = m.group(2).strip()
         return f"date_add({expr}, {n} * 7)"
-    out = re.sub(r"\bDATEADD\s*\(\s*week\s*,\s*([^,]+)\s*,\s*([^)]+)\)", dateadd_week_repl, out, flags=re.IGNORECASE)
+    if 'dateadd' in folded:
+        out = DATEADD_WEEK_PATTERN.sub(dateadd_week_repl, out)
+        folded = fold_ignorecase(out)
 
     # Handle ADD_MONTHS function (already supported in Databricks)
     # No transformation needed, but ensure it's recognized
 
     return out
 
+# Auto-fix substitutions, applied in order by auto_fix_databricks_issues. Rules share one
+# alternation only where a single scan gives the same result as running them in turn; the
+# others capture text that later rules still rewrite, so they stay separate passes.
+# A rule's scan is skipped unless one of its keywords (every match contains one) occurs in
+# the case-folded SQL.
+AUTO_FIX_REWRITES = [(keywords, re.compile(pat, re.IGNORECASE), repl) for keywords, pat, repl in [
+    # 1. Data type conversions. TEXT/BPCHAR run after VARCHAR(MAX): once it becomes STRING,
+    # a word glued to its closing paren no longer starts at a word boundary
+    (('super', 'varchar'), r'\bSUPER\b|\bVARCHAR\s*\(\s*MAX\s*\)', 'STRING'),
+    (('text', 'bpchar'), r'\bTEXT\b(?!\s*\()|\bBPCHAR\b', 'STRING'),  # Avoid replacing TEXT() function
+
+    # 2. Mathematical functions
+    (('mod',), r'\bMOD\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)', r'(\1 % \2)'),
+
+    # 3. Type casting improvements
+    (('real',), r'CAST\s*\(\s*([^)]+)\s+AS\s+REAL\s*\)', r'CAST(\1 AS FLOAT)'),
+    (('precision',), r'CAST\s*\(\s*([^)]+)\s+AS\s+DOUBLE\s+PRECISION\s*\)', r'CAST(\1 AS DOUBLE)'),
+
+    # 4. Array functions
+    (('array_to_string',), r'ARRAY_TO_STRING\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)', r'array_join(\1, \2)'),
+    (('string_to_array',), r'STRING_TO_ARRAY\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)', r'split(\1, \2)'),
+
+    # 5. Date functions
+    (('epoch',), r'DATE_PART\s*\(\s*[\'"]epoch[\'\"]\s*,\s*([^)]+)\s*\)', r'unix_timestamp(\1)'),
+    (('epoch',), r'EXTRACT\s*\(\s*EPOCH\s+FROM\s+([^)]+)\s*\)', r'unix_timestamp(\1)'),
+
+    # 6. String functions with escape handling
+    (('regexp_replace',), r'REGEXP_REPLACE\s*\(\s*([^,]+)\s*,\s*([^,]+)\s*,\s*([^,]+)\s*,\s*[\'"]g[\'\"]\s*\)', r'regexp_replace(\1, \2, \3)'),
+
+    # 7. JSON functions (remove unsupported parameters)
+    (('json_extract_path_text',), r'JSON_EXTRACT_PATH_TEXT\s*\(\s*([^,]+)\s*,\s*([^,]+)\s*,\s*true\s*\)', r'get_json_object(\1, concat("$.", \2))'),
+    (('json_extract_path_text',), r'JSON_EXTRACT_PATH_TEXT\s*\(\s*([^,]+)\s*,\s*([^,]+)\s*,\s*false\s*\)', r'get_json_object(\1, concat("$.", \2))'),
+
+    # 8. Performance improvements
+    (('exists',), r'EXISTS\s*\(\s*SELECT\s+\*\s+FROM', r'EXISTS (SELECT 1 FROM'),
+]]
+
+# Linear probe for the boolean-comparison fixes: their (\w+) prefix backtracks through
+# every word of the SQL, so only run them when a "= true"/"= false" is present
+BOOLEAN_COMPARISON_PROBE = re.compile(r'=\s*(?:true|false)\b', re.IGNORECASE)
+BOOLEAN_TRUE_PATTERN = re.compile(r'(\w+)\s*=\s*true\b', re.IGNORECASE)
+BOOLEAN_FALSE_PATTERN = re.compile(r'(\w+)\s*=\s*false\b', re.IGNORECASE)
+NOT_IS_NULL_PATTERN = re.compile(r'\bNOT\s+([^()]+?)\s+IS\s+NULL\b', re.IGNORECASE)
+QUALIFY_ROW_NUMBER_PATTERN = re.compile(r'\bQUALIFY\s+(ROW_NUMBER\(\)\s+OVER\s*\([^)]+\))\s*=\s*1\b', re.IGNORECASE)
+
+# Patterns auto_fix_databricks_issues can only warn about
+AUTO_FIX_CORRELATED_SUBQUERY_PATTERNS = [re.compile(pat, re.IGNORECASE | re.DOTALL) for pat in [
+    r'\(\s*SELECT\s+[^)]*FROM\s+\w+\s+WHERE\s+[^)]*\w+\.\w+\s*=',  # (SELECT ... WHERE outer.col = ...)
+    r'\(\s*SELECT\s+[^)]*\)\s+AS\s+\w+,\s*\(\s*SELECT',            # Multiple scalar subqueries
+]]
+MISSING_TABLE_PATTERNS = [re.compile(pat, re.IGNORECASE) for pat in [
+    r'daily_adoptions_\w+',                    # adoption tables
+    r'data_engineering_staging\.\w+\.\w+',     # staging tables
+]]
+COMPLEX_FEATURE_PATTERNS = [(re.compile(pat, re.IGNORECASE), warning) for pat, warning in [
+    (r'\bPIVOT\s*\(', "MANUAL: PIVOT syntax may differ - verify column names and aggregation"),
+    (r'\bUNPIVOT\s*\(', "MANUAL: UNPIVOT syntax may differ - verify structure"),
+    (r'\bLATERAL\s+VIEW\s+OUTER\b', "MANUAL: LATERAL VIEW OUTER behavior may differ"),
+    (r'\bCOPY\s+INTO\b', "MANUAL: COPY INTO syntax differs from Redshift"),
+]]
+
 def auto_fix_databricks_issues(sql: str) -> tuple[str, list]:
     """
     Automatically fix implementable Databricks issues instead of just warning.
@@ -830,158 +1019,143 @@ def auto_fix_databricks_issues(sql: str) -> tuple[str, list]:
     out = sql
     remaining_warnings = []
     
-    # 1. AUTO-FIX: Data type conversions
-    out = re.sub(r'\bSUPER\b', 'STRING', out, flags=re.IGNORECASE)
-    out = re.sub(r'\bVARCHAR\s*\(\s*MAX\s*\)', 'STRING', out, flags=re.IGNORECASE)
-    out = re.sub(r'\bTEXT\b(?!\s*\()', 'STRING', out, flags=re.IGNORECASE)  # Avoid replacing TEXT() function
-    out = re.sub(r'\bBPCHAR\b', 'STRING', out, flags=re.IGNORECASE)
-    
-    # 2. AUTO-FIX: Mathematical functions
-    out = re.sub(r'\bMOD\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)', r'(\1 % \2)', out, flags=re.IGNORECASE)
-    
-    # 3. AUTO-FIX: Type casting improvements
-    out = re.sub(r'CAST\s*\(\s*([^)]+)\s+AS\s+REAL\s*\)', r'CAST(\1 AS FLOAT)', out, flags=re.IGNORECASE)
-    out = re.sub(r'CAST\s*\(\s*([^)]+)\s+AS\s+DOUBLE\s+PRECISION\s*\)', r'CAST(\1 AS DOUBLE)', out, flags=re.IGNORECASE)
-    
-    # 4. AUTO-FIX: Array functions
-    out = re.sub(r'ARRAY_TO_STRING\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)', r'array_join(\1, \2)', out, flags=re.IGNORECASE)
-    out = re.sub(r'STRING_TO_ARRAY\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)', r'split(\1, \2)', out, flags=re.IGNORECASE)
-    
-    # 5. AUTO-FIX: Date functions
-    out = re.sub(r'DATE_PART\s*\(\s*[\'"]epoch[\'\"]\s*,\s*([^)]+)\s*\)', r'unix_timestamp(\1)', out, flags=re.IGNORECASE)
-    out = re.sub(r'EXTRACT\s*\(\s*EPOCH\s+FROM\s+([^)]+)\s*\)', r'unix_timestamp(\1)', out, flags=re.IGNORECASE)
-    
-    # 6. AUTO-FIX: String functions with escape handling
-    out = re.sub(r'REGEXP_REPLACE\s*\(\s*([^,]+)\s*,\s*([^,]+)\s*,\s*([^,]+)\s*,\s*[\'"]g[\'\"]\s*\)', r'regexp_replace(\1, \2, \3)', out, flags=re.IGNORECASE)
-    
-    # 7. AUTO-FIX: JSON functions (remove unsupported parameters)
-    out = re.sub(r'JSON_EXTRACT_PATH_TEXT\s*\(\s*([^,]+)\s*,\s*([^,]+)\s*,\s*true\s*\)', r'get_json_object(\1, concat("$.", \2))', out, flags=re.IGNORECASE)
-    out = re.sub(r'JSON_EXTRACT_PATH_TEXT\s*\(\s*([^,]+)\s*,\s*([^,]+)\s*,\s*false\s*\)', r'get_json_object(\1, concat("$.", \2))', out, flags=re.IGNORECASE)
-    
-    # 8. AUTO-FIX: Performance improvements
-    out = re.sub(r'EXISTS\s*\(\s*SELECT\s+\*\s+FROM', r'EXISTS (SELECT 1 FROM', out, flags=re.IGNORECASE)
+    # 1-8. AUTO-FIX: Data types, math, casts, arrays, dates, strings, JSON, EXISTS
+    folded = fold_ignorecase(out)
+    for keywords, pattern, repl in AUTO_FIX_REWRITES:
+        if any(keyword in folded for keyword in keywords):
+            out = pattern.sub(repl, out)
+            folded = fold_ignorecase(out)
     
     # 9. AUTO-FIX: Boolean comparisons
-    out = re.sub(r'(\w+)\s*=\s*true\b', r'\1 IS TRUE', out, flags=re.IGNORECASE)
-    out = re.sub(r'(\w+)\s*=\s*false\b', r'\1 IS FALSE', out, flags=re.IGNORECASE)
+    if BOOLEAN_COMPARISON_PROBE.search(out):
+        out = BOOLEAN_TRUE_PATTERN.sub(r'\1 IS TRUE', out)
+        out = BOOLEAN_FALSE_PATTERN.sub(r'\1 IS FALSE', out)
     
     # 10. AUTO-FIX: NULL comparisons
-    out = re.sub(r'\bNOT\s+([^()]+?)\s+IS\s+NULL\b', r'\1 IS NOT NULL', out, flags=re.IGNORECASE)
+    if 'null' in fold_ignorecase(out):
+        out = NOT_IS_NULL_PATTERN.sub(r'\1 IS NOT NULL', out)
     
     # 11. AUTO-FIX: Window functions without QUALIFY
-    qualify_pattern = r'\bQUALIFY\s+(ROW_NUMBER\(\)\s+OVER\s*\([^)]+\))\s*=\s*1\b'
-    if re.search(qualify_pattern, out, re.IGNORECASE):
+    if QUALIFY_ROW_NUMBER_PATTERN.search(out):
         # Convert QUALIFY ROW_NUMBER() OVER (...) = 1 to subquery with WHERE
         def replace_qualify(match):
             row_number_expr = match.group(1)
             return f'-- Converted from QUALIFY: Add this as WHERE {row_number_expr} = 1 in subquery'
-        out = re.sub(qualify_pattern, replace_qualify, out, flags=re.IGNORECASE)
+        out = QUALIFY_ROW_NUMBER_PATTERN.sub(replace_qualify, out)
     
     # REMAINING WARNINGS (things we can't auto-fix)
     
     # Correlated scalar subqueries (need manual intervention)
-    correlated_subquery_patterns = [
-        r'\(\s*SELECT\s+[^)]*FROM\s+\w+\s+WHERE\s+[^)]*\w+\.\w+\s*=',  # (SELECT ... WHERE outer.col = ...)
-        r'\(\s*SELECT\s+[^)]*\)\s+AS\s+\w+,\s*\(\s*SELECT',            # Multiple scalar subqueries
-    ]
-    
-    for pattern in correlated_subquery_patterns:
-        if re.search(pattern, out, re.IGNORECASE | re.DOTALL):
+    for pattern in AUTO_FIX_CORRELATED_SUBQUERY_PATTERNS:
+        if pattern.search(out):
             remaining_warnings.append("-- MANUAL: Correlated scalar subqueries detected - rewrite as JOINs or CTEs")
             remaining_warnings.append("-- EXAMPLE: WITH metrics AS (SELECT 'type1' as t, COUNT(*) as c FROM table1 UNION ALL SELECT 'type2', COUNT(*) FROM table2)")
             remaining_warnings.append("-- SELECT SUM(CASE WHEN t='type1' THEN c END) as col1, SUM(CASE WHEN t='type2' THEN c END) as col2 FROM metrics")
             break
     
     # Missing table patterns (need verification)
-    missing_table_patterns = [
-        r'daily_adoptions_\w+',                    # adoption tables
-        r'data_engineering_staging\.\w+\.\w+',     # staging tables
-    ]
-    
-    for pattern in missing_table_patterns:
-        if re.search(pattern, out, re.IGNORECASE):
+    for pattern in MISSING_TABLE_PATTERNS:
+        if pattern.search(out):
             remaining_warnings.append("-- VERIFY: Check if tables exist in Databricks - run: SHOW TABLES IN schema")
             break
     
     # Complex features that need manual review
-    complex_patterns = [
-        (r'\bPIVOT\s*\(', "MANUAL: PIVOT syntax may differ - verify column names and aggregation"),
-        (r'\bUNPIVOT\s*\(', "MANUAL: UNPIVOT syntax may differ - verify structure"),
-        (r'\bLATERAL\s+VIEW\s+OUTER\b', "MANUAL: LATERAL VIEW OUTER behavior may differ"),
-        (r'\bCOPY\s+INTO\b', "MANUAL: COPY INTO syntax differs from Redshift"),
-    ]
-    
-    for pattern, warning in complex_patterns:
-        if re.search(pattern, out, re.IGNORECASE):
+    for pattern, warning in COMPLEX_FEATURE_PATTERNS:
+        if pattern.search(out):
             remaining_warnings.append(f"-- {warning}")
     
     return out, remaining_warnings
 
+# Patterns and the warning add_inline_warnings_to_sql puts under each line they match in.
+# They are run over the whole SQL, so whitespace/negated classes exclude \n to keep every
+# match within one line. A pattern's scan is skipped unless its keyword (part of every
+# match) occurs in the case-folded SQL.
+INLINE_WARNING_PATTERNS = [(keyword, re.compile(pat, re.IGNORECASE), warning) for keyword, pat, warning in [
+    ('where', r'\([^\S\n]*SELECT[^\S\n]+[^)\n]*FROM[^\S\n]+\w+[^\S\n]+WHERE', "    -- ⚠️  ISSUE: Correlated subquery may fail in Databricks"),
+    ('daily_adoptions_', r'daily_adoptions_\w+', "    -- ⚠️  VERIFY: Check if this adoption table exists in Databricks"),
+    ('qualify', r'\bQUALIFY\b', "    -- ❌ ERROR: QUALIFY not supported - rewrite using window functions"),
+    ('varchar', r'VARCHAR[^\S\n]*\([^\S\n]*MAX[^\S\n]*\)', "    -- 🔄 CONVERT: VARCHAR(MAX) → STRING"),
+    ('super', r'\bSUPER\b', "    -- 🔄 CONVERT: SUPER → STRING or appropriate STRUCT type"),
+]]
+
+NEWLINE_PATTERN = re.compile(r'\n')
+
 def add_inline_warnings_to_sql(sql: str) -> str:
     """Add inline warnings right next to problematic SQL patterns."""
-    lines = sql.split('\n')
-    result_lines = []
+    # One scan of the whole SQL per pattern, noting which lines each warning goes under
+    folded = fold_ignorecase(sql)
+    warnings_by_line = {}
+    newline_offsets = None
+    for keyword, pattern, warning in INLINE_WARNING_PATTERNS:
+        if keyword not in folded:
+            continue
+        for match in pattern.finditer(sql):
+            if newline_offsets is None:
+                # Offsets of every newline, found once; a match's line is how many precede it
+                newline_offsets = [newline.start() for newline in NEWLINE_PATTERN.finditer(sql)]
+            line_warnings = warnings_by_line.setdefault(bisect_left(newline_offsets, match.start()), [])
+            if warning not in line_warnings:
+                line_warnings.append(warning)
+    
+    if not warnings_by_line:
+        return sql
     
-    for i, line in enumerate(lines):
+    result_lines = []
+    for i, line in enumerate(sql.split('\n')):
         result_lines.append(line)
-        
-        # Check for specific problematic patterns in this line
-        if re.search(r'\(\s*SELECT\s+[^)]*FROM\s+\w+\s+WHERE', line, re.IGNORECASE):
-            result_lines.append("    -- ⚠️  ISSUE: Correlated subquery may fail in Databricks")
-        
-        if re.search(r'daily_adoptions_\w+', line, re.IGNORECASE):
-            result_lines.append("    -- ⚠️  VERIFY: Check if this adoption table exists in Databricks")
-        
-        if re.search(r'\bQUALIFY\b', line, re.IGNORECASE):
-            result_lines.append("    -- ❌ ERROR: QUALIFY not supported - rewrite using window functions")
-        
-        if re.search(r'VARCHAR\s*\(\s*MAX\s*\)', line, re.IGNORECASE):
-            result_lines.append("    -- 🔄 CONVERT: VARCHAR(MAX) → STRING")
-        
-        if re.search(r'\bSUPER\b', line, re.IGNORECASE):
-            result_lines.append("    -- 🔄 CONVERT: SUPER → STRING or appropriate STRUCT type")
+        result_lines.extend(warnings_by_line.get(i, ()))
     
     return '\n'.join(result_lines)
 
-def add_comprehensive_function_mappings(sql: str) -> str:
-    """Add more comprehensive function mappings based on team exceptions."""
+# Advanced transformations based on real exceptions
+ADVANCED_FUNCTION_REWRITES = [(re.compile(pat, re.IGNORECASE), repl) for pat, repl in [
+    # Window functions with QUALIFY
+    (r'\bQUALIFY\s+ROW_NUMBER\(\)\s+OVER\s*\([^)]+\)\s*=\s*1', 
+     '-- TODO: Rewrite QUALIFY as WHERE ROW_NUMBER() OVER (...) = 1 in subquery'),
     
-    # Advanced transformations based on real exceptions
-    advanced_patterns = [
-        # Window functions with QUALIFY
-        (r'\bQUALIFY\s+ROW_NUMBER\(\)\s+OVER\s*\([^)]+\)\s*=\s*1', 
-         '-- TODO: Rewrite QUALIFY as WHERE ROW_NUMBER() OVER (...) = 1 in subquery'),
-        
-        # Complex JSON handling
-        (r'JSON_EXTRACT_PATH_TEXT\s*\(\s*([^,]+)\s*,\s*\'([^\']+)\'\s*,\s*true\s*\)',
-         r'get_json_object(\1, "$.\2") -- Note: ignoreCase parameter removed'),
-        
-        # Array functions
-        (r'ARRAY_TO_STRING\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)',
-         r'array_join(\1, \2)'),
-        
-        # Advanced date functions
-        (r'DATE_PART\s*\(\s*\'epoch\'\s*,\s*([^)]+)\s*\)',
-         r'unix_timestamp(\1)'),
-        
-        # String functions with escape handling
-        (r'REGEXP_REPLACE\s*\(\s*([^,]+)\s*,\s*\'([^\']+)\'\s*,\s*\'([^\']+)\'\s*,\s*\'g\'\s*\)',
-         r'regexp_replace(\1, "\2", "\3")'),
-        
-        # Mathematical functions
-        (r'\bMOD\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)',
-         r'(\1 % \2)'),
-        
-        # Type casting edge cases
-        (r'CAST\s*\(\s*([^)]+)\s+AS\s+REAL\s*\)',
-         r'CAST(\1 AS FLOAT)'),
-    ]
+    # Complex JSON handling
+    (r'JSON_EXTRACT_PATH_TEXT\s*\(\s*([^,]+)\s*,\s*\'([^\']+)\'\s*,\s*true\s*\)',
+     r'get_json_object(\1, "$.\2") -- Note: ignoreCase parameter removed'),
+    
+    # Array functions
+    (r'ARRAY_TO_STRING\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)',
+     r'array_join(\1, \2)'),
     
-    for pattern, replacement in advanced_patterns:
-        sql = re.sub(pattern, replacement, sql, flags=re.IGNORECASE)
+    # Advanced date functions
+    (r'DATE_PART\s*\(\s*\'epoch\'\s*,\s*([^)]+)\s*\)',
+     r'unix_timestamp(\1)'),
+    
+    # String functions with escape handling
+    (r'REGEXP_REPLACE\s*\(\s*([^,]+)\s*,\s*\'([^\']+)\'\s*,\s*\'([^\']+)\'\s*,\s*\'g\'\s*\)',
+     r'regexp_replace(\1, "\2", "\3")'),
+    
+    # Mathematical functions
+    (r'\bMOD\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)',
+     r'(\1 % \2)'),
+    
+    # Type casting edge cases
+    (r'CAST\s*\(\s*([^)]+)\s+AS\s+REAL\s*\)',
+     r'CAST(\1 AS FLOAT)'),
+]]
+
+def add_comprehensive_function_mappings(sql: str) -> str:
+    """Add more comprehensive function mappings based on team exceptions."""
+    for pattern, replacement in ADVANCED_FUNCTION_REWRITES:
+        sql = pattern.sub(replacement, sql)
     
     return sql
 
+# Post-rewrite checks apply_sql_rewrites flags for manual review
+CORRELATED_SCALAR_SUBQUERY_PATTERN = re.compile(r'\(\s*SELECT\s+[^)]+\s+FROM\s+\w+\s+WHERE\s+[^)]*\bld\.', re.IGNORECASE | re.DOTALL)
+MULTIPLE_SCALAR_SUBQUERIES_PATTERN = re.compile(r'\(\s*SELECT\s+.*?\s+FROM\s+.*?\)\s+AS\s+.*?\(\s*SELECT\s+.*?\s+FROM\s+.*?\)', re.IGNORECASE | re.DOTALL)
+ADOPTION_TABLES_PATTERN = re.compile(r'daily_adoptions_\w+', re.IGNORECASE)
+CORRELATED_SUBQUERY_PATTERN = re.compile(r'WHERE.*\(\s*SELECT.*WHERE.*\.\w+\s*=\s*\w+\.\w+', re.IGNORECASE | re.DOTALL)
+LEGACY_TABLE_REF_PATTERNS = [re.compile(pat, re.IGNORECASE) for pat in [
+    r'\bprod\.[A-Za-z0-9_]+\.[A-Za-z0-9_]+',  # prod.schema.table pattern
+    r'\braw_[A-Za-z0-9_]+\.[A-Za-z0-9_]+',    # raw_source.table pattern  
+    r'\bstaging\.[A-Za-z0-9_]+\.[A-Za-z0-9_]+' # staging.schema.table pattern
+]]
+
 def apply_sql_rewrites(sql: str) -> str:
     """
     Apply comprehensive SQL transformations for Redshift -> Databricks migration.
@@ -999,8 +1173,9 @@ def apply_sql_rewrites(sql: str) -> str:
     out = add_comprehensive_function_mappings(out)
     
     # Apply simple regex rewrites
-    for pat, repl in SQL_SIMPLE_REWRITES:
-        out = re.sub(pat, repl, out, flags=re.IGNORECASE)
+    out = SIMPLE_REWRITE_PATTERN.sub(lambda m: SIMPLE_REWRITE_REPLACEMENTS[m.lastgroup], out)
+    for pat, repl in SQL_BACKREF_REWRITES:
+        out = pat.sub(repl, out)
     
     # Apply complex function transformations
     out = rewrite_complex_functions(out)
@@ -1008,72 +1183,158 @@ def apply_sql_rewrites(sql: str) -> str:
     # Add inline warnings to problematic patterns (simplified since many are now auto-fixed)
     out = add_inline_warnings_to_sql(out)
     
+    # TODO banners for manual review, collected in check order and prepended once at the end
+    # (the last one added ends up first); the checks only look at the SQL itself
+    headers = []
+    folded = fold_ignorecase(out)
+    
     # Flag QUALIFY for manual inspection (if not already auto-converted)
     if QUALIFY_PATTERN.search(out) and 'Converted from QUALIFY' not in out:
-        out = "-- TODO(manual): Translate QUALIFY to WHERE with window subquery\n" + out
+        headers.append("-- TODO(manual): Translate QUALIFY to WHERE with window subquery\n")
     
     # Flag correlated scalar subqueries that may need manual conversion
-    # Pattern: (SELECT ... FROM table WHERE condition referencing outer table)
-    correlated_subquery_pattern = r'\(\s*SELECT\s+[^)]+\s+FROM\s+\w+\s+WHERE\s+[^)]*\bld\.'
-    if re.search(correlated_subquery_pattern, out, re.IGNORECASE | re.DOTALL):
-        out = "-- TODO(manual): Databricks requires correlated scalar subqueries to be aggregated or rewritten as JOINs\n-- Error: UNSUPPORTED_SUBQUERY_EXPRESSION_CATEGORY.MUST_AGGREGATE_CORRELATED_SCALAR_SUBQUERY\n-- See: https://docs.databricks.com/sql/language-manual/sql-ref-subqueries.html\n" + out
+    # Pattern: (SELECT ... FROM table WHERE condition referencing outer table); backtracks at
+    # every "(", so only run it when the outer alias "ld." is there at all
+    if 'ld.' in folded and CORRELATED_SCALAR_SUBQUERY_PATTERN.search(out):
+        headers.append("-- TODO(manual): Databricks requires correlated scalar subqueries to be aggregated or rewritten as JOINs\n-- Error: UNSUPPORTED_SUBQUERY_EXPRESSION_CATEGORY.MUST_AGGREGATE_CORRELATED_SCALAR_SUBQUERY\n-- See: https://docs.databricks.com/sql/language-manual/sql-ref-subqueries.html\n")
     
     # Flag multiple scalar subqueries in SELECT clause (common anti-pattern)
     # Look for pattern: (SELECT ... FROM ...) AS ... (SELECT ... FROM ...)
-    scalar_subquery_pattern = r'\(\s*SELECT\s+.*?\s+FROM\s+.*?\)\s+AS\s+.*?\(\s*SELECT\s+.*?\s+FROM\s+.*?\)'
-    if re.search(scalar_subquery_pattern, out, re.IGNORECASE | re.DOTALL):
+    if MULTIPLE_SCALAR_SUBQUERIES_PATTERN.search(out):
         print("⚠️  WARNING: Multiple scalar subqueries detected - may cause performance issues in Databricks")
-        out = "-- TODO(manual): Multiple scalar subqueries detected - rewrite as JOINs or CTEs\n-- EXAMPLE: Replace (SELECT COUNT(*) FROM table1) AS col1, (SELECT COUNT(*) FROM table2) AS col2\n-- WITH: WITH metrics AS (SELECT 'table1' as type, COUNT(*) as cnt FROM table1 UNION ALL SELECT 'table2', COUNT(*) FROM table2)\n-- SELECT SUM(CASE WHEN type='table1' THEN cnt END) as col1, SUM(CASE WHEN type='table2' THEN cnt END) as col2 FROM metrics\n" + out
+        headers.append("-- TODO(manual): Multiple scalar subqueries detected - rewrite as JOINs or CTEs\n-- EXAMPLE: Replace (SELECT COUNT(*) FROM table1) AS col1, (SELECT COUNT(*) FROM table2) AS col2\n-- WITH: WITH metrics AS (SELECT 'table1' as type, COUNT(*) as cnt FROM table1 UNION ALL SELECT 'table2', COUNT(*) FROM table2)\n-- SELECT SUM(CASE WHEN type='table1' THEN cnt END) as col1, SUM(CASE WHEN type='table2' THEN cnt END) as col2 FROM metrics\n")
     
     # Flag potential missing tables (tables that might not exist in Databricks)
-    adoption_tables_pattern = r'daily_adoptions_\w+'
-    if re.search(adoption_tables_pattern, out, re.IGNORECASE):
+    if ADOPTION_TABLES_PATTERN.search(out):
         print("⚠️  WARNING: Adoption tables detected - verify these exist in Databricks")
-        out = "-- TODO(manual): Verify table existence in Databricks - run: SHOW TABLES IN schema LIKE '*adoption*'\n-- Some tables may have different names, schemas, or may not have been migrated yet\n" + out
+        headers.append("-- TODO(manual): Verify table existence in Databricks - run: SHOW TABLES IN schema LIKE '*adoption*'\n-- Some tables may have different names, schemas, or may not have been migrated yet\n")
     
     # Flag other potential Databricks compatibility issues
-    # 1. Check for correlated subqueries (common cause of UNSUPPORTED_SUBQUERY_EXPRESSION_CATEGORY error)
-    correlated_subquery_pattern = r'WHERE.*\(\s*SELECT.*WHERE.*\.\w+\s*=\s*\w+\.\w+'
-    if re.search(correlated_subquery_pattern, out, re.IGNORECASE | re.DOTALL):
+    # 1. Check for correlated subqueries (common cause of UNSUPPORTED_SUBQUERY_EXPRESSION_CATEGORY error);
+    # the DOTALL .* scan needs an outer and an inner WHERE, so skip it with fewer than two
+    if folded.count('where') >= 2 and CORRELATED_SUBQUERY_PATTERN.search(out):
         print("⚠️  WARNING: Potential correlated subquery detected")
-        out = "-- TODO(manual): Correlated subquery detected - may need to rewrite as JOIN\n-- ERROR: UNSUPPORTED_SUBQUERY_EXPRESSION_CATEGORY.MUST_AGGREGATE_CORRELATED_SCALAR_SUBQUERY\n" + out
+        headers.append("-- TODO(manual): Correlated subquery detected - may need to rewrite as JOIN\n-- ERROR: UNSUPPORTED_SUBQUERY_EXPRESSION_CATEGORY.MUST_AGGREGATE_CORRELATED_SCALAR_SUBQUERY\n")
     
     # 2. Check for potential table/view references that might not exist
-    table_ref_patterns = [
-        r'\bprod\.[A-Za-z0-9_]+\.[A-Za-z0-9_]+',  # prod.schema.table pattern
-        r'\braw_[A-Za-z0-9_]+\.[A-Za-z0-9_]+',    # raw_source.table pattern  
-        r'\bstaging\.[A-Za-z0-9_]+\.[A-Za-z0-9_]+' # staging.schema.table pattern
-    ]
-    
-    for pattern in table_ref_patterns:
-        if re.search(pattern, out, re.IGNORECASE):
+    for pattern in LEGACY_TABLE_REF_PATTERNS:
+        if pattern.search(out):
             print("⚠️  WARNING: Legacy table references detected - verify schema mapping")
-            out = "-- TODO(manual): Legacy table references detected - verify schema/catalog mapping in Databricks\n-- TIP: Use SHOW TABLES to verify table existence and correct names\n" + out
+            headers.append("-- TODO(manual): Legacy table references detected - verify schema/catalog mapping in Databricks\n-- TIP: Use SHOW TABLES to verify table existence and correct names\n")
             break
     
     # Add header warnings for remaining manual issues
     if remaining_warnings:
-        warning_header = '\n'.join(remaining_warnings) + '\n\n'
-        out = warning_header + out
+        headers.append('\n'.join(remaining_warnings) + '\n\n')
     
-    return out
+    headers.reverse()
+    headers.append(out)
+    return ''.join(headers)
 
 # ---------- 3) YAML processing ----------
 
-def transform_hex_yaml(doc: dict, databricks_conn_id: str, redshift_conn_ids=None):
-    d = deepcopy(doc)
+# Redshift functions and legacy schema references tallied in the conversion summary
+CONVERSION_FUNCTION_PATTERNS = ['nvl(', 'ifnull(', 'to_char(', 'strpos(', 'regexp_substr(', 'dateadd(', 'datediff(']
+CONVERSION_SCHEMA_PATTERNS = ['prod.', 'prod_', 'staging.', 'dev.', 'warehouse.']
+CONVERSION_PATTERN = re.compile(
+    '(?P<function>' + '|'.join(map(re.escape, CONVERSION_FUNCTION_PATTERNS)) + ')'
+    '|(?P<table>' + '|'.join(map(re.escape, CONVERSION_SCHEMA_PATTERNS)) + ')',
+    re.IGNORECASE
+)
+
+# Schema heuristics for picking Redshift cells when no connection IDs are given
+PROD_SCHEMA_REF_PATTERN = re.compile(r'\bprod\.[A-Za-z0-9_]+\.[A-Za-z0-9_]+', re.IGNORECASE)
+PROD_UNDERSCORE_REF_PATTERN = re.compile(r'\bprod_[A-Za-z0-9_]+\.[A-Za-z0-9_]+', re.IGNORECASE)
+
+DEFAULT_REDSHIFT_CONN_IDS = [
+    "e2694948-2c20-47d3-b127-71448e2bf238",  # Redshift (with raw tables)
+    "0d0da619-5aa7-4f55-b020-ba94bfa77917",  # Redshift
+    "63ebcea0-017f-4bcf-b58a-a2340a75845f"   # Redshift (with external tables)
+]
+
+# Byte markers of everything transform_hex_yaml can change besides Redshift connection IDs
+TRANSFORM_MARKERS = (b"BOOLEAN", b"TOGGLE", b"CHECKBOX", b"dataConnections")
+# UTF-16/UTF-32 input never contains the ASCII markers above; such files take the full
+# parse, so UTF-16 gets converted and UTF-32 (which PyYAML can't read) reports an error
+# instead of being passed through unconverted
+WIDE_ENCODING_BOMS = (codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+
+def needs_transform(raw: bytes, redshift_conn_ids=None) -> bool:
+    """
+    Cheap byte scan run before parsing: False means transform_hex_yaml would leave
+    the document unchanged (no Redshift connection IDs, boolean inputs or shared
+    data connections), so the file can be passed through as-is.
+    """
+    if raw.startswith(WIDE_ENCODING_BOMS):
+        return True  # can't byte-scan UTF-16/UTF-32; parse it
+    if not redshift_conn_ids:
+        if redshift_conn_ids is not None:
+            return True  # schema heuristics apply to every SQL cell
+        redshift_conn_ids = DEFAULT_REDSHIFT_CONN_IDS
+    return any(conn_id.encode("utf-8") in raw for conn_id in redshift_conn_ids) or \
+        any(marker in raw for marker in TRANSFORM_MARKERS)
+
+@lru_cache(maxsize=8192)
+def convert_cell_sql(query: str):
+    """
+    Returns: (rewritten_sql, functions_converted, tables_remapped) for one cell's SQL.
+    Cached because notebooks (and the files in a ZIP) often repeat the same cell SQL.
+    """
+    functions_converted = 0
+    tables_remapped = 0
+    for match in CONVERSION_PATTERN.finditer(query):
+        if match.lastgroup == "function":
+            functions_converted += 1
+        else:
+            tables_remapped += 1
+    return apply_sql_rewrites(query), functions_converted, tables_remapped
+
+def _clone_transform_targets(doc: dict) -> dict:
+    """
+    Shallow-copies just the parts of doc that transform_hex_yaml modifies (the top level,
+    each cell with its data/config dict, and sharedAssets.dataConnections). Everything
+    else (outputs, metadata, other cell fields) is shared with doc rather than deep-copied.
+    """
+    d = dict(doc)
+    cells = d.get("cells")
+    if isinstance(cells, list):
+        d["cells"] = []
+        for cell in cells:
+            if isinstance(cell, dict):
+                cell = dict(cell)
+                for key in ("data", "config"):
+                    if isinstance(cell.get(key), dict):
+                        cell[key] = dict(cell[key])
+            d["cells"].append(cell)
+    shared_assets = d.get("sharedAssets")
+    if isinstance(shared_assets, dict) and isinstance(shared_assets.get("dataConnections"), list):
+        d["sharedAssets"] = dict(shared_assets, dataConnections=list(shared_assets["dataConnections"]))
+    return d
+
+# Fewest distinct cell queries worth handing to an executor; below this IPC costs more than it saves
+PARALLEL_MIN_QUERIES = 64
+
+def transform_hex_yaml(doc: dict, databricks_conn_id: str, redshift_conn_ids=None, in_place=False,
+                       executor=None):
+    """
+    Returns: (new_doc, cells_rewritten, conversion_summary) where conversion_summary
+    holds the numbers of Redshift functions and schema references, counted in the
+    original SQL of each rewritten cell.
+    doc is left unchanged: new_doc gets its own copies of the parts that are updated and
+    shares the rest. With in_place=True, doc itself is modified and returned (for callers
+    that just loaded it and won't reuse the original).
+    If executor (e.g. a ProcessPoolExecutor) is given, the distinct cell queries of large
+    projects are rewritten across its workers.
+    """
+    d = doc if in_place else _clone_transform_targets(doc)
     
     # Default Redshift connection IDs if none provided
     if redshift_conn_ids is None:
-        redshift_conn_ids = [
-            "e2694948-2c20-47d3-b127-71448e2bf238",  # Redshift (with raw tables)
-            "0d0da619-5aa7-4f55-b020-ba94bfa77917",  # Redshift
-            "63ebcea0-017f-4bcf-b58a-a2340a75845f"   # Redshift (with external tables)
-        ]
+        redshift_conn_ids = DEFAULT_REDSHIFT_CONN_IDS
         print(f"🔍 Using default Redshift connection IDs: {redshift_conn_ids}")
     
     redshift_conn_ids = set(redshift_conn_ids or [])
-    rewrote_cells = 0
+    sql_cells = []  # (data, query) for each Redshift cell whose SQL gets rewritten
     for cell in d.get("cells", []):
         cell_type = cell.get("type") or cell.get("cellType")
         
@@ -1109,8 +1370,7 @@ def transform_hex_yaml(doc: dict, databricks_conn_id: str, redshift_conn_ids=Non
             # Explicitly identified Redshift connection
             should_process = True
         elif not redshift_conn_ids and isinstance(query, str) and (
-            re.search(r'\bprod\.[A-Za-z0-9_]+\.[A-Za-z0-9_]+', query, re.IGNORECASE) or
-            re.search(r'\bprod_[A-Za-z0-9_]+\.[A-Za-z0-9_]+', query, re.IGNORECASE)
+            PROD_SCHEMA_REF_PATTERN.search(query) or PROD_UNDERSCORE_REF_PATTERN.search(query)
         ):
             # Fallback: If no specific Redshift conn IDs provided, use schema heuristics
             should_process = True
@@ -1124,14 +1384,28 @@ def transform_hex_yaml(doc: dict, databricks_conn_id: str, redshift_conn_ids=Non
         elif "dataConnectionId" in data:
             data["dataConnectionId"] = databricks_conn_id
 
-        # 2) Rewrite SQL
+        # 2) Queue the SQL for rewriting
         if isinstance(query, str):
-            rewritten_sql = apply_sql_rewrites(query)
-            if "query" in data:
-                data["query"] = rewritten_sql
-            if "source" in data:
-                data["source"] = rewritten_sql
-            rewrote_cells += 1
+            sql_cells.append((data, query))
+
+    # Rewrite each distinct query once, in parallel when the project is large enough
+    queries = list(dict.fromkeys(query for _, query in sql_cells))
+    if executor is not None and len(queries) >= PARALLEL_MIN_QUERIES:
+        conversions = dict(zip(queries, executor.map(convert_cell_sql, queries, chunksize=8)))
+    else:
+        conversions = {query: convert_cell_sql(query) for query in queries}
+
+    functions_converted = 0
+    tables_remapped = 0
+    for data, query in sql_cells:
+        rewritten_sql, cell_functions, cell_tables = conversions[query]
+        functions_converted += cell_functions
+        tables_remapped += cell_tables
+        if "query" in data:
+            data["query"] = rewritten_sql
+        if "source" in data:
+            data["source"] = rewritten_sql
+    rewrote_cells = len(sql_cells)
 
     # Update project-level default connection if present
     if "defaultDataConnectionId" in d:
@@ -1165,19 +1439,26 @@ def transform_hex_yaml(doc: dict, databricks_conn_id: str, redshift_conn_ids=Non
                 else:
                     data_connections.append({"dataConnectionId": databricks_conn_id})
 
-    return d, rewrote_cells
+    return d, rewrote_cells, {
+        "functions_converted": functions_converted,
+        "tables_remapped": tables_remapped,
+    }
 
 def load_yaml(path: str) -> dict:
     with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=CSafeLoader)
 
 def save_yaml(obj: dict, path: str):
     with open(path, "w", encoding="utf-8") as f:
-        yaml.safe_dump(obj, f, sort_keys=False, allow_unicode=True)
+        yaml.dump(obj, f, Dumper=CSafeDumper, sort_keys=False, allow_unicode=True)
+
+# --in output path: input.yaml -> input_databricks.yaml when --out isn't given
+YAML_SUFFIX_PATTERN = re.compile(r'\.ya?ml$', re.IGNORECASE)
 
-def process_file(in_path: str, out_path: str, databricks_conn_id: str, redshift_conn_ids=None):
+def process_file(in_path: str, out_path: str, databricks_conn_id: str, redshift_conn_ids=None, executor=None):
     doc = load_yaml(in_path)
-    new_doc, n = transform_hex_yaml(doc, databricks_conn_id, redshift_conn_ids)
+    new_doc, n, _ = transform_hex_yaml(doc, databricks_conn_id, redshift_conn_ids, in_place=True,
+                                       executor=executor)
     save_yaml(new_doc, out_path)
     print(f"[OK] {in_path} -> {out_path} | cells rewritten: {n}")
 
@@ -1189,6 +1470,7 @@ def main():
     ap.add_argument("--out-dir", dest="out_dir", help="Output directory for converted YAMLs (optional)")
     ap.add_argument("--databricks-conn-id", required=True, help="Target Databricks dataConnectionId")
     ap.add_argument("--redshift-conn-ids", nargs="*", default=None, help="Redshift connection IDs to target (optional - uses hardcoded defaults if not specified)")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes for --in-dir files, or for the cells of a large --in project (default: CPU count)")
     args = ap.parse_args()
 
     if not args.in_path and not args.in_dir:
@@ -1197,24 +1479,47 @@ def main():
     if args.in_dir:
         # Create output directory if specified
         output_dir = args.out_dir or args.in_dir
-        if args.out_dir and not os.path.exists(args.out_dir):
-            os.makedirs(args.out_dir)
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
             
-        for name in os.listdir(args.in_dir):
-            if not name.lower().endswith((".yaml", ".yml")):
-                continue
-            in_path = os.path.join(args.in_dir, name)
+        in_paths, out_paths = [], []
+        # scandir's entries carry the file type, so skipping non-files costs no extra stat
+        with os.scandir(args.in_dir) as entries:
+            yaml_entries = [entry for entry in entries
+                            if entry.name.lower().endswith((".yaml", ".yml")) and entry.is_file()]
+        for entry in yaml_entries:
+            name = entry.name
+            in_path = entry.path
             base, ext = os.path.splitext(name)
             # If same directory, add suffix. If different directory, keep original name
             if args.out_dir and args.out_dir != args.in_dir:
                 out_name = name  # Keep original name in different directory
             else:
                 out_name = f"{base}_databricks{ext}"  # Add suffix in same directory
-            out_path = os.path.join(output_dir, out_name)
-            process_file(in_path, out_path, args.databricks_conn_id, args.redshift_conn_ids)
+            in_paths.append(in_path)
+            out_paths.append(os.path.join(output_dir, out_name))
+
+        # Files are independent, so convert them across worker processes
+        jobs = min(args.jobs, len(in_paths))
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as ex:
+                # Hand out several files per task so pickling/IPC overhead is amortized
+                chunksize = max(1, len(in_paths) // (4 * jobs))
+                list(ex.map(process_file, in_paths, out_paths,
+                            repeat(args.databricks_conn_id), repeat(args.redshift_conn_ids),
+                            chunksize=chunksize))
+        else:
+            for in_path, out_path in zip(in_paths, out_paths):
+                process_file(in_path, out_path, args.databricks_conn_id, args.redshift_conn_ids)
     else:
-        out_path = args.out_path or re.sub(r'\.ya?ml$', '_databricks.yaml', args.in_path, flags=re.IGNORECASE)
-        process_file(args.in_path, out_path, args.databricks_conn_id, args.redshift_conn_ids)
+        out_path = args.out_path or YAML_SUFFIX_PATTERN.sub('_databricks.yaml', args.in_path)
+        if args.jobs > 1:
+            # A single project can still spread its cells' SQL across worker processes
+            # (workers only start if the project has enough distinct queries)
+            with ProcessPoolExecutor(max_workers=args.jobs) as ex:
+                process_file(args.in_path, out_path, args.databricks_conn_id, args.redshift_conn_ids, executor=ex)
+        else:
+            process_file(args.in_path, out_path, args.databricks_conn_id, args.redshift_conn_ids)
 
 if __name__ == "__main__":
     main()